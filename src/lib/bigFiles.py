@@ -2,24 +2,25 @@ from pathlib import Path
 import pandas as pd
 import logging
 import lib.processing.files as files
-from lib.processing.files import DataFormat, DataFile, Folder, StackedFile
+from lib.processing.files import DataFormat, DataProperty, DataFile, Folder, StackedFile
 from typing import Iterator
-from lib.json import JsonSynchroniser
+from lib.metadataStore import getStore
 
 class DFWriter:
 
     _chunkPrefix = "chunk"
-    _metaFilenames = "fileNames"
 
-    def __init__(self, outputFilePath: Path, chunkFormat: DataFormat = DataFormat.PARQUET, subDirName: str = "bigFileWriter", loadOnInit: bool = True):
-        self.outputFile = DataFile(outputFilePath)
+    def __init__(self, outputFilePath: Path, chunkFormat: DataFormat = DataFormat.PARQUET, subDirName: str = "bigFileWriter", loadOnInit: bool = True, schema: dict[str, str] = {}):
+        self._properties = {DataProperty.SCHEMA.value: schema} if schema else {}
+        self.outputFile = DataFile(outputFilePath, self._properties)
         self._chunkFormat = chunkFormat
 
         self.workingDir = Folder(outputFilePath.parent / subDirName, create=True)
-        self.metadata = JsonSynchroniser(self.workingDir.path / "metadata.json")
+        self.metadata = getStore().writerMetadata(self.workingDir.path)
 
         self._sectionFiles: list[DataFile] = []
         self._uniqueColumns: dict[str, None] = {}
+        self._addedWriters: list[DFWriter] = []
 
         if loadOnInit:
             self._loadFiles()
@@ -28,16 +29,28 @@ class DFWriter:
                 logging.info(f"Added {len(self._sectionFiles)} existing files from working directory '{self.workingDir.path}'")
 
     def _loadFiles(self) -> None:
-        for fileName in self.metadata.get(self._metaFilenames, []):
-            dataFile = DataFile(self.workingDir.path / fileName)
+        dataFiles = [DataFile(self.workingDir.path / fileName, self._properties) for fileName in self.metadata.getChunks()]
+        if not all(dataFile.exists() for dataFile in dataFiles):
+            logging.warning(f"Recorded files missing from working directory '{self.workingDir.path}', starting fresh")
+            self._clearChunks()
+            return
+
+        for dataFile in dataFiles:
             self._sectionFiles.append(dataFile)
             self._uniqueColumns |= {column: None for column in dataFile.getColumns()}
 
+    def _clearChunks(self) -> None:
+        # Only chunk records are reset, other writer properties remain valid
+        self.metadata.clearChunks()
+
     def _wroteFile(self, name: str) -> None:
-        if self.metadata.get(self._metaFilenames) is None:
-            self.metadata[self._metaFilenames] = [name]
-        else:
-            self.metadata[self._metaFilenames].append(name)
+        self.metadata.addChunk(name)
+
+    def addWriter(self, writer: 'DFWriter') -> None:
+        # Files of added writers are combined after previously written files, in the order writers are added
+        self._sectionFiles.extend(writer._sectionFiles)
+        self._uniqueColumns |= writer._uniqueColumns
+        self._addedWriters.append(writer)
 
     def writtenFileCount(self) -> int:
         return len(self._sectionFiles)
@@ -49,7 +62,7 @@ class DFWriter:
         if not fileName:
             fileName = f"{self._chunkPrefix}_{len(self._sectionFiles) if index < 0 else index}"
             
-        subfile = DataFile(self.workingDir.path / (fileName + self._chunkFormat.value))
+        subfile = DataFile(self.workingDir.path / (fileName + self._chunkFormat.value), self._properties)
         subfile.write(df, index=False)
         self._wroteFile(subfile.path.name)
 
@@ -70,22 +83,42 @@ class DFWriter:
             files.moveDataFile(self._sectionFiles[0], self.outputFile)
         else:
             logging.info("Combining into one file")
-            self.outputFile.writeIterator(combinedIterator(self._sectionFiles, readChunkSize), list(self._uniqueColumns), **kwargs)
+            if not combineParquetFiles(self.outputFile, self._sectionFiles, list(self._uniqueColumns)):
+                self.outputFile.writeIterator(combinedIterator(self._sectionFiles, readChunkSize), list(self._uniqueColumns), **kwargs)
+
             logging.info(f"Created a single file at {self.outputFile.path}")
         
         if removeParts:
             self._sectionFiles.clear()
+            self.metadata.clear()
             self.workingDir.delete()
 
+            for writer in self._addedWriters:
+                writer.metadata.clear()
+                if writer.workingDir.exists():
+                    writer.workingDir.delete()
+
+    def releaseParts(self, datasetPath: Path) -> None:
+        # Written chunks become a dataset folder as the final output, metadata is cleared so a later writer on this path starts fresh
+        dataset = Folder(datasetPath)
+        if dataset.exists():
+            dataset.delete()
+
+        self.workingDir.path.rename(datasetPath)
+        self.metadata.clear()
+        self._sectionFiles.clear()
+
 class RecordWriter(DFWriter):
     
     _metaRows = "rowsPerSubsection"
+    _metaBatchPrefix = "batch:"
 
-    def __init__(self, outputFilePath: Path, rowsPerSubsection: int, chunkFormat: DataFormat = DataFormat.PARQUET, subDirName: str = "bigFileWriter"):
-        super().__init__(outputFilePath, chunkFormat, subDirName, False)
+    def __init__(self, outputFilePath: Path, rowsPerSubsection: int, chunkFormat: DataFormat = DataFormat.PARQUET, subDirName: str = "bigFileWriter", schema: dict[str, str] = {}):
+        super().__init__(outputFilePath, chunkFormat, subDirName, False, schema)
 
         self._rowsPerSubsection = rowsPerSubsection
         self._records = []
+        self._batchKeys = []
 
         if self.metadata.get(self._metaRows, -1) != rowsPerSubsection: # Different chunk size used from previous, throw out results
             self.metadata.clear()
@@ -93,9 +126,20 @@ class RecordWriter(DFWriter):
         else:
             self._loadFiles()
 
+    def _clearChunks(self) -> None:
+        for chunkName in self.metadata.getChunks():
+            self.metadata.pop(f"{self._metaBatchPrefix}{chunkName}", None)
+
+        super()._clearChunks()
+
     def _writeRecords(self) -> None:
-        super().write(pd.DataFrame.from_records(self._records))
+        fileName = f"{self._chunkPrefix}_{len(self._sectionFiles)}"
+        if self._batchKeys: # Recorded before the chunk so keys are never missing for a written chunk
+            self.metadata[f"{self._metaBatchPrefix}{fileName}{self._chunkFormat.value}"] = self._batchKeys
+
+        super().write(pd.DataFrame.from_records(self._records), fileName)
         self._records.clear()
+        self._batchKeys = []
 
     def writtenRecordCount(self) -> int:
         return self.writtenFileCount() * self._rowsPerSubsection
@@ -109,10 +153,26 @@ class RecordWriter(DFWriter):
         for record in records:
             self.write(record)
 
-    def combine(self, readChunkSize: int = 1024, removeParts: bool = False, **kwargs) -> None:
+    def writeBatch(self, records: list[dict], batchKeys: list[str]) -> None:
+        # Batches are never split across chunks, so keys of a written chunk mark complete batches for resuming
+        self._records.extend(records)
+        self._batchKeys.extend(batchKeys)
+        if len(self._records) >= self._rowsPerSubsection:
+            self._writeRecords()
+
+    def completedBatchKeys(self) -> set[str]:
+        keys = set()
+        for chunkName in self.metadata.getChunks():
+            keys.update(self.metadata.get(f"{self._metaBatchPrefix}{chunkName}", []))
+
+        return keys
+
+    def flush(self) -> None:
         if self._records:
             self._writeRecords()
 
+    def combine(self, readChunkSize: int = 1024, removeParts: bool = False, **kwargs) -> None:
+        self.flush()
         super().combine(readChunkSize, removeParts, **kwargs)
 
 def combinedIterator(dataFiles: list[DataFile], chunkSize: int, **kwargs: dict) -> Iterator[pd.DataFrame]:
@@ -120,6 +180,15 @@ def combinedIterator(dataFiles: list[DataFile], chunkSize: int, **kwargs: dict)
         for chunk in file.readIterator(chunkSize, **kwargs):
             yield chunk
 
+def combineParquetFiles(outputFile: DataFile, dataFiles: list[DataFile], columns: list[str]) -> bool:
+    # Streams row groups through arrow without converting to pandas, only possible when all files are parquet
+    if outputFile.format != DataFormat.PARQUET or any(dataFile.format != DataFormat.PARQUET for dataFile in dataFiles):
+        return False
+
+    schema = files.unifySchemas([dataFile.getSchema() for dataFile in dataFiles], columns, outputFile.getSchemaOverrides())
+    outputFile.writeTables((table for dataFile in dataFiles for table in dataFile.readTables()), schema)
+    return True
+
 def combineDirectoryFiles(outputFilePath: Path, inputFolderPath: Path, matchPattern: str = "*.*", chunkSize: int = 1024, deleteOld: bool = False, **kwargs: dict) -> None:
     inputDataFiles = [dataFile for dataFile in  [DataFile(path) for path in inputFolderPath.glob(matchPattern)] if dataFile.format != DataFormat.UNKNOWN and dataFile.format != DataFormat.STACKED]
     logging.info(f"Found {len(inputDataFiles)} files to combine")
@@ -133,7 +202,9 @@ def combineDataFiles(outputFilePath: Path, dataFiles: list[DataFile], chunkSize:
         columns.extend([column for column in dataFile.getColumns() if column not in columns])
 
     logging.info(f"Combining into one file at {outputFilePath}")
-    outputDataFile.writeIterator(combinedIterator(dataFiles, chunkSize), columns, index=False, **kwargs)
+    if not combineParquetFiles(outputDataFile, dataFiles, columns):
+        outputDataFile.writeIterator(combinedIterator(dataFiles, chunkSize), columns, index=False, **kwargs)
+
     logging.info(f"Successfully combined into a single file")
 
     if not outputDataFile.exists():
@@ -148,9 +219,12 @@ def combineDataFiles(outputFilePath: Path, dataFiles: list[DataFile], chunkSize:
             dataFile.delete()
 
 class StackedDFWriter:
+
+    _stagingPrefix = "." # Chunks are written to hidden folders so incomplete sections are never read as part of the stacked file
+
     def __init__(self, outputPath: Path, subsections: list[str], chunkFormat: DataFormat = DataFormat.PARQUET):
         self.outputFile = StackedFile(outputPath)
-        self._subWriters = {subsection: DFWriter(outputPath / f"{subsection}.csv", chunkFormat=chunkFormat, subDirName=subsection) for subsection in subsections}
+        self._subWriters = {subsection: DFWriter(outputPath / f"{subsection}.csv", chunkFormat=chunkFormat, subDirName=f"{self._stagingPrefix}{subsection}") for subsection in subsections}
 
     def uniqueColumns(self, subsection: str) -> list[str]:
         return self._subWriters[subsection].uniqueColumns()
@@ -163,5 +237,9 @@ class StackedDFWriter:
         for writer in self._subWriters.values():
             writer.combine(removeParts=removeParts)
 
+    def releaseParts(self) -> None:
+        for subsection, writer in self._subWriters.items():
+            writer.releaseParts(self.outputFile.path / subsection)
+
     def completedCount(self) -> int:
         return min(writer.writtenFileCount() for writer in self._subWriters.values())
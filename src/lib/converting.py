@@ -1,10 +1,15 @@
-from lib.processing.mapping import Map
-from lib.processing.files import DataFile, StackedFile
+from lib.processing.mapping import Map, MapPlan
+from lib.processing.files import DataFile, DataFormat, StackedFile
+import lib.processing.files as files
 import pandas as pd
+import pyarrow as pa
 import logging
 from lib.bigFiles import StackedDFWriter
-import gc
 from pathlib import Path
+import concurrent.futures as cf
+import threading
+import queue
+from typing import Iterator
 
 class Converter:
 
@@ -14,58 +19,49 @@ class Converter:
     _entityIDLabel = "entity_id"
     _entityIDEvent = "collection"
 
-    def __init__(self, inputFile: DataFile, outputPath: Path):
+    _queueTimeout = 1 # Seconds between checks for a stopped pipeline
+
+    def __init__(self, inputFile: DataFile, outputPath: Path, outputFormat: DataFormat = DataFormat.CSV):
         self.inputFile = inputFile
         self.outputPath = outputPath
+        self.outputFormat = outputFormat
 
-    def convert(self, map: Map, chunkSize: int, datasetID: str, entityEvent: str, entityColumn: str, verbose: bool) -> tuple[bool, dict]:
+    def convert(self, map: Map, chunkSize: int, datasetID: str, entityEvent: str, entityColumn: str, verbose: bool, mappedColumnsOnly: bool = False, workers: int = 1) -> tuple[bool, dict]:
         logging.info("Processing chunks for conversion")
 
-        def _processChunk(chunk: pd.DataFrame) -> dict[str, pd.DataFrame]:
-            dfEvents = map.applyTo(chunk) # Returns a multi-index dataframe
-            
-            if not dfEvents:
-                return {}
-            
-            error = f"Unable to generate '{self._entityIDLabel}':"
-            if entityEvent not in dfEvents:
-                logging.error(f"{error} no event found '{entityEvent}'")
-                return {}
-            
-            if entityColumn not in dfEvents[entityEvent].columns:
-                logging.error(f"{error} dataset is missing field '{entityColumn}' in event '{entityEvent}'")
-                return {}
-            
-            dfEvents[self._entityIDEvent][self._datasetIDLabel] = datasetID
-            dfEvents[self._entityIDEvent][self._entityIDLabel] = dfEvents[self._entityIDEvent][self._datasetIDLabel] + dfEvents[entityEvent][entityColumn]
-            return dfEvents
-    
+        columns = None
+        if mappedColumnsOnly and not map.isEmpty():
+            inputColumns = self.inputFile.getColumns()
+            columns = [column for column in map.referencedColumns() if column in inputColumns]
+            logging.info(f"Reading {len(columns)} of {len(inputColumns)} columns referenced by map")
+
         writer = StackedDFWriter(self.outputPath, map.events)
 
-        totalRows = 0
-        chunks = self.inputFile.readIterator(chunkSize, low_memory=False)
+        if self.inputFile.supportsArrow(low_memory=False): # Arrow tables are only converted to pandas once they need mapping
+            chunks = self.inputFile.readArrowIterator(chunkSize, columns, low_memory=False)
+        else:
+            chunks = self.inputFile.readIterator(chunkSize, columns, low_memory=False)
+
         completed = writer.completedCount()
 
         if completed > 0:
             logging.info(f"Already completed {completed} chunks, resuming...")
 
-        for idx, df in enumerate(chunks, start=1):
-            totalRows += len(df)
-
-            if idx > completed:
-                if verbose:
-                    print(f"At chunk: {idx}", end='\r')
-
-                dfSections = _processChunk(df)
-                if not dfSections:
-                    return False, {}
-
-                writer.write(dfSections, idx-1)
+        chunkArgs = (datasetID, entityEvent, entityColumn)
+        if workers > 1:
+            logging.info(f"Converting with {workers} worker processes")
+            success, totalRows = self._convertPipelined(chunks, completed, writer, map, chunkArgs, workers, verbose)
+        else:
+            success, totalRows = self._convertSerial(chunks, completed, writer, map, chunkArgs, verbose)
 
-            del df
-            gc.collect()
+        if not success:
+            return False, {}
 
-        writer.combine(removeParts=True)
+        if self.outputFormat == DataFormat.PARQUET:
+            writer.releaseParts() # Parts are read back directly by StackedFile
+            logging.info(f"Written parquet parts for each event to {self.outputPath}")
+        else:
+            writer.combine(removeParts=True)
 
         metadata = {
             "total columns": len(self.inputFile.getColumns()),
@@ -74,3 +70,142 @@ class Converter:
         }
 
         return True, metadata
+
+    def _convertSerial(self, chunks: Iterator[pd.DataFrame | pa.Table], completed: int, writer: StackedDFWriter, map: Map, chunkArgs: tuple, verbose: bool) -> tuple[bool, int]:
+        totalRows = 0
+        plan = None
+
+        for idx, chunk in enumerate(chunks, start=1):
+            totalRows += len(chunk)
+
+            if idx <= completed:
+                continue
+
+            if verbose:
+                print(f"At chunk: {idx}", end='\r')
+
+            df = files.tableToDataFrame(chunk) if isinstance(chunk, pa.Table) else chunk
+            if plan is None or not plan.matches(list(df.columns)): # Compiled once from the header and reused for each chunk
+                plan = map.compile(list(df.columns))
+
+            dfSections, error = mapChunk(plan, df, *chunkArgs)
+            if error:
+                logging.error(error)
+                return False, totalRows
+
+            writer.write(dfSections, idx-1)
+
+        return True, totalRows
+
+    def _convertPipelined(self, chunks: Iterator[pd.DataFrame | pa.Table], completed: int, writer: StackedDFWriter, map: Map, chunkArgs: tuple, workers: int, verbose: bool) -> tuple[bool, int]:
+        # A reader thread feeds chunks to worker processes, results are written in chunk order so completedCount stays valid for resuming
+        chunkQueue: queue.Queue[tuple[int, pd.DataFrame | pa.Table] | None] = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+        readerErrors: list[Exception] = []
+        totalRows = 0
+
+        def _read() -> None:
+            nonlocal totalRows
+            try:
+                for idx, chunk in enumerate(chunks, start=1):
+                    totalRows += len(chunk)
+                    if idx <= completed:
+                        continue
+
+                    while not stop.is_set():
+                        try:
+                            chunkQueue.put((idx, chunk), timeout=self._queueTimeout)
+                            break
+                        except queue.Full:
+                            continue
+
+                    if stop.is_set():
+                        return
+                    
+            except Exception as e:
+                readerErrors.append(e)
+
+            finally:
+                chunkQueue.put(None)
+
+        reader = threading.Thread(target=_read, daemon=True)
+        reader.start()
+
+        executor = cf.ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(map, *chunkArgs))
+        futures: dict[int, cf.Future] = {}
+        nextIdx = completed + 1
+        readerDone = False
+        success = False
+
+        try:
+            while True:
+                while not readerDone and len(futures) < workers * 2: # Keep workers busy while limiting chunks held in memory
+                    item = chunkQueue.get()
+                    if item is None:
+                        readerDone = True
+                        break
+
+                    idx, chunk = item
+                    futures[idx] = executor.submit(_workerMapChunk, chunk)
+
+                if nextIdx not in futures: # All chunks read and written
+                    success = not readerErrors
+                    break
+
+                dfSections, error = futures.pop(nextIdx).result()
+                if error:
+                    logging.error(error)
+                    break
+
+                if verbose:
+                    print(f"At chunk: {nextIdx}", end='\r')
+
+                writer.write(dfSections, nextIdx-1)
+                nextIdx += 1
+
+        finally:
+            stop.set()
+            executor.shutdown(wait=success, cancel_futures=True)
+
+            while reader.is_alive(): # Drain queue so the reader isn't left blocked
+                try:
+                    chunkQueue.get(timeout=self._queueTimeout)
+                except queue.Empty:
+                    pass
+
+        if readerErrors:
+            raise readerErrors[0]
+
+        return success, totalRows
+
+def mapChunk(plan: MapPlan, df: pd.DataFrame, datasetID: str, entityEvent: str, entityColumn: str) -> tuple[dict[str, pd.DataFrame], str]:
+    dfEvents = plan.applyTo(df)
+
+    if not dfEvents:
+        return {}, "No columns mapped from chunk"
+
+    error = f"Unable to generate '{Converter._entityIDLabel}':"
+    if entityEvent not in dfEvents:
+        return {}, f"{error} no event found '{entityEvent}'"
+
+    if entityColumn not in dfEvents[entityEvent].columns:
+        return {}, f"{error} dataset is missing field '{entityColumn}' in event '{entityEvent}'"
+
+    dfEvents[Converter._entityIDEvent][Converter._datasetIDLabel] = datasetID
+    dfEvents[Converter._entityIDEvent][Converter._entityIDLabel] = dfEvents[Converter._entityIDEvent][Converter._datasetIDLabel] + dfEvents[entityEvent][entityColumn]
+    return dfEvents, ""
+
+_workerState: dict = {}
+
+def _initWorker(map: Map, datasetID: str, entityEvent: str, entityColumn: str) -> None:
+    _workerState.update(map=map, plan=None, chunkArgs=(datasetID, entityEvent, entityColumn))
+
+def _workerMapChunk(chunk: pd.DataFrame | pa.Table) -> tuple[dict[str, pd.DataFrame], str]:
+    df = files.tableToDataFrame(chunk) if isinstance(chunk, pa.Table) else chunk
+
+    plan: MapPlan = _workerState["plan"]
+    if plan is None or not plan.matches(list(df.columns)):
+        plan = _workerState["map"].compile(list(df.columns))
+        _workerState["plan"] = plan
+
+    return mapChunk(plan, df, *_workerState["chunkArgs"])
@@ -1,14 +1,14 @@
 import re
 import requests
 import urllib.parse
-from bs4 import BeautifulSoup
 import concurrent.futures as cf
 from pathlib import Path
 import logging
 import lib.downloading as dl
 import time
 from lib.progressBar import ProgressBar
-from lib.json import JsonSynchroniser
+from lib.metadataStore import CrawlProgress, getStore
+import lib.htmlParsing as htmlParsing
 from requests.adapters import HTTPAdapter, Retry
 
 
@@ -43,12 +43,10 @@ class PageData:
 class Crawler:
 
     _progressFile = "crawlerProgress.json"
-    _metaSettings = "settings"
     _metaSettingURL = "url"
     _metaSettingRegex = "regex"
     _metaSettingDepth = "maxDepth"
     _metaSkipFolders = "skipFolders"
-    _metaProgress = "progress"
 
     _dirStr = "directories"
     _fileStr = "files"
@@ -78,11 +76,16 @@ class Crawler:
         if not self.metadataDir.exists():
             self.metadataDir.mkdir(parents=True)
 
-        metadata = JsonSynchroniser(self.metadataDir / self._progressFile)
+        self._crawl(self._getProgress(), entryURL, fileRegex, pattern, maxDepth, skipFolders, ignoreProgress)
+
+    def _getProgress(self) -> CrawlProgress:
+        return getStore().crawlProgress(self.metadataDir / self._progressFile)
+
+    def _crawl(self, progress: CrawlProgress, entryURL: str, fileRegex: str, pattern: re.Pattern, maxDepth: int, skipFolders: list[str], ignoreProgress: bool) -> None:
         if ignoreProgress:
-            metadata.clear()
+            progress.clear()
 
-        savedSettings = metadata.get(self._metaSettings, {})
+        savedSettings = dict(progress.settings)
         currentSettings = {
             self._metaSettingURL: entryURL,
             self._metaSettingRegex: fileRegex,
@@ -92,11 +95,11 @@ class Crawler:
 
         for setting, value in currentSettings.items():
             if setting in savedSettings and value != savedSettings[setting]:
-                metadata.clear()
+                progress.clear()
                 break
 
-        metadata[self._metaSettings] = currentSettings
-        crawlerData = metadata.get(self._metaProgress, [])
+        progress.settings.update(currentSettings)
+        crawlerData = progress.getDepths()
 
         if crawlerData:
             if len(crawlerData) >= maxDepth:
@@ -104,28 +107,27 @@ class Crawler:
             
             logging.info(f"Progress found, resuming crawling at depth: {len(crawlerData)}")
         else:
-            metadata[self._metaProgress] = [self._getPageLinks(entryURL, pattern)]
+            crawlerData = [self._getPageLinks(entryURL, pattern)]
+            progress.addDepth(crawlerData[0])
             logging.info(f"Successfully retrieved entry url {entryURL}, crawling subfolders")
 
-        while len(metadata[self._metaProgress]) <= maxDepth:
+        while len(crawlerData) <= maxDepth:
 
             folderURLs = []
-            for url, urlLinks in metadata[self._metaProgress][-1].items():
+            for url, urlLinks in crawlerData[-1].items():
                 for folder in urlLinks.get(self._dirStr, []):
                     if (folder not in skipFolders) and (folder.rstrip("/") not in skipFolders):
                         folderURLs.append(urllib.parse.urljoin(url, folder))
-                        
-            # folderURLs = [urllib.parse.urljoin(url, folder) for url, urlLinks in metadata[self._metaProgress][-1].items() for folder in urlLinks.get(self._dirStr, [])]
 
             if not folderURLs:
                 break
 
             pageData = self._parallelPageLinks(folderURLs, pattern)
-            metadata[self._metaProgress].append(pageData)
+            crawlerData.append(pageData)
+            progress.addDepth(pageData)
 
     def getFileURLs(self, altDLURL: str = "") -> list[str]:
-        metadata = JsonSynchroniser(self.metadataDir / self._progressFile)
-        crawlerProgress: list[dict[str, dict[str, list[str]]]] = metadata.get(self._metaProgress, [])
+        crawlerProgress: list[dict[str, dict[str, list[str]]]] = self._getProgress().getDepths()
         return [urllib.parse.urljoin(url if not altDLURL else altDLURL, file) for layer in crawlerProgress for url, urlData in layer.items() for file in urlData.get(self._fileStr, [])]
 
     def _parallelPageLinks(self, urlList: list[str], pattern: re.Pattern = None, retries: int = 5,) -> dict[str, dict[str, list[str]]]:
@@ -153,11 +155,8 @@ class Crawler:
         dirLinks = []
         fileLinks = []
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        for hyperlink in soup.find_all("a"):
-            link: str = hyperlink.get('href')
-
-            if link is None or any(link.startswith(c) for c in ("/", "?")):
+        for link in htmlParsing.extractLinks(response.text):
+            if any(link.startswith(c) for c in ("/", "?")):
                 continue
 
             if link.endswith("/"): # Subdirectory link
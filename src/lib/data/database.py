@@ -7,7 +7,7 @@ from lib.processing import tasks
 import lib.processing.updating as upd
 from datetime import datetime
 from lib.processing.files import DataFile
-from lib.json import JsonSynchroniser
+from lib.metadataStore import MetadataStore, RunMetadata, getStore
 
 class Flag(Enum):
     VERBOSE   = "quiet" # Verbosity enabled by default, flag is used when silenced
@@ -30,7 +30,6 @@ class Updates(Enum):
     MONTHLY = "monthly"
 
 class Database:
-    _metadataFileName = "metadata.json"
     _exampleFolderName = "examples"
 
     def __init__(self, location: str, database: str, subsection: str, name: str, config: dict):
@@ -53,7 +52,8 @@ class Database:
         self.workingDirs: dict[Step, Path] = {}
         self.exampleDir: Path = None
 
-        self._metadata: JsonSynchroniser = None
+        self._store: MetadataStore = getStore()
+        self._metadata: RunMetadata = None
         self._dataDate: str = ""
 
     def __str__(self):
@@ -75,7 +75,7 @@ class Database:
             self.workingDirs = {step: folder / step.value for step in Step}
             self.exampleDir = folder / self._exampleFolderName
 
-            self._metadata = JsonSynchroniser(folder / self._metadataFileName)
+            self._metadata = self._store.runMetadata(self.name, folder)
             self._dataDate = folder.name
 
         todaysDataDir = self.dataDir / str(datetime.now().date())   
@@ -91,6 +91,13 @@ class Database:
         _generate(historicFolders[historicFolderNum])
         return True
 
+    def _getPreviousStep(self, step: Step, index: int) -> tuple[Path, dict]:
+        folderName, stepMetadata = self._store.lastSuccessfulStep(self.name, step.value, index, self._dataDate)
+        if not folderName:
+            return None, {}
+
+        return self.dataDir / folderName / step.value, stepMetadata
+
     def _getFiles(self, step: Step, limitIdx: int = -1) -> list[list[DataFile]]:
         files = []
         
@@ -130,7 +137,8 @@ class Database:
         retrieve = Retrieve._value2member_map_.get(retrieveType)
         for idx, taskConfig in enumerate(downloadTaskConfig):
             if retrieve == Retrieve.URL:
-                task = tasks.UrlRetrieve(self.workingDirs[Step.DOWNLOADING], taskConfig, self.locationName)
+                previousDir, previousMetadata = self._getPreviousStep(Step.DOWNLOADING, idx)
+                task = tasks.UrlRetrieve(self.workingDirs[Step.DOWNLOADING], taskConfig, self.locationName, previousDir, previousMetadata)
             elif retrieve == Retrieve.CRAWL:
                 task = tasks.CrawlRetrieve(self.workingDirs[Step.DOWNLOADING], taskConfig, self.locationName)
             elif retrieve == Retrieve.SCRIPT:
@@ -166,7 +174,7 @@ class Database:
         task = tasks.Conversion(self.workingDirs[Step.CONVERSION], conversionConfig, self.name, self._dataDate, self.locationName, self._getFiles(Step.DOWNLOADING), self._getFiles(Step.PROCESSING))
         self._execute(Step.CONVERSION, 0, task, flags)
 
-    def update(self) -> None:
+    def update(self, flags: list[Flag]) -> None:
         updateConfig: dict = self.config.get("updating", {})
         if not updateConfig:
             raise Exception(f"No update config specified as required for {self.name}")
@@ -189,20 +197,23 @@ class Database:
             raise Exception(f"Unhandled updater type: {updaterType}") from AttributeError
         
         lastUpdate = None
-        for folder in self._getHistoricFolders():
-            historicMetadata = JsonSynchroniser(folder / self._metadataFileName)
-            lastSuccess = historicMetadata[Step.DOWNLOADING][0].get(tasks.Metadata.LAST_SUCCESS_START, None)
+        lastSuccess = self._store.lastSuccessStart(self.name, Step.DOWNLOADING.value, 0)
+        if lastSuccess is not None:
+            lastUpdate = datetime.fromisoformat(lastSuccess)
 
-            if lastSuccess is not None:
-                lastUpdate = datetime.fromisoformat(lastSuccess)
-
-        if (lastUpdate is not None) and (updater.updateReady(lastUpdate)):
+        if (lastUpdate is not None) and (not updater.updateReady(lastUpdate)):
             logging.info(f"Data source '{self.name}' is not ready for update.")
             return
 
-        self.download()
-        self.process()
-        self.convert()
+        self.download(flags)
+
+        downloadMetadata: list[dict] = self._metadata.get(Step.DOWNLOADING.value, [])
+        if downloadMetadata and all(stepMetadata.get(tasks.UrlRetrieve._metaUnchanged, False) for stepMetadata in downloadMetadata):
+            logging.info(f"No downloads for '{self.name}' changed since last update, skipping processing and conversion.")
+            return
+
+        self.process(flags, 0)
+        self.convert(flags, 0)
     
     def _execute(self, step: Step, index: int, task: tasks.Task, flags: list[Flag]) -> bool:
         overwrite = Flag.OVERWRITE in flags
@@ -250,28 +261,27 @@ class Database:
         return " | ".join(f"{flag.value}={flag in flags}" for flag in Flag)
 
     def updateMetadata(self, step: Step, stepIndex: int, metadata: dict[tasks.Metadata, any]) -> None:
-        parsedMetadata = {}
-        for key, value in metadata.items():
-            if not isinstance(key, tasks.Metadata):
-                continue
 
-            if key == tasks.Metadata.CUSTOM:
-                for customKey, customValue in value.items():
-                    parsedMetadata[customKey] = customValue
+        def parseMetadata(metadata: dict[tasks.Metadata, any]) -> dict:
+            parsedMetadata = {}
+            for key, value in metadata.items():
+                if not isinstance(key, tasks.Metadata):
+                    continue
+
+                if key == tasks.Metadata.CUSTOM:
+                    for customKey, customValue in value.items():
+                        parsedMetadata[customKey] = customValue
 
-                continue
+                    continue
 
-            parsedMetadata[key.value] = value
+                if key == tasks.Metadata.TASK_COMPONENTS:
+                    value = [parseMetadata(component) for component in value]
 
-        if step.value not in self._metadata:
-            self._metadata[step.value] = [parsedMetadata]
-            return
-        
-        previousMetadata: list = self._metadata[step.value]
-        if stepIndex < len(previousMetadata):
-            previousMetadata[stepIndex] |= parsedMetadata
-        else:
-            previousMetadata.append(parsedMetadata)
+                parsedMetadata[key.value] = value
+
+            return parsedMetadata
+
+        self._metadata.updateStep(step.value, stepIndex, parseMetadata(metadata))
 
 class DatabaseFactory:
     def __init__(self, locationName: str, databaseName: str, config: dict):
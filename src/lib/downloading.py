@@ -6,22 +6,34 @@ import logging
 from lib.progressBar import ProgressBar
 from urllib.parse import quote
 import time
+import os
+import threading
+import shutil
+from enum import Enum
+import concurrent.futures as cf
+from lib.json import JsonSynchroniser
 
 class RepeatDownloader:
-    def __init__(self, headers: dict = {}, username: str = "", password: str = "", chunkSize: int = 1024*1024, verbose: bool = False):
+    def __init__(self, headers: dict = {}, username: str = "", password: str = "", chunkSize: int = 1024*1024, verbose: bool = False, segments: int = 1):
         self.headers = headers
         self.auth = buildAuth(username, password) if username else None
         self.chunkSize = chunkSize
         self.verbose = verbose
+        self.segments = segments
 
     def download(self, url: str, filePath: Path, customChunkSize: int = -1, additionalHeaders: dict = {}) -> bool:
         chunkSize = customChunkSize if customChunkSize >= 0 else self.chunkSize
-        return download(url, filePath, chunkSize, self.verbose, self.headers | additionalHeaders, self.auth)
+        return download(url, filePath, chunkSize, self.verbose, self.headers | additionalHeaders, self.auth, self.segments)
+
+class Validator(Enum):
+    ETAG = "ETag"
+    LAST_MODIFIED = "Last-Modified"
+    CONTENT_LENGTH = "Content-Length"
 
 def buildAuth(username: str, password: str) -> HTTPBasicAuth:
     return HTTPBasicAuth(username, password)
 
-def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None) -> bool:
+def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None, segments: int = 1) -> bool:
     if chunkSize <= 0:
         logging.error(f"Invalid chunk size `{chunkSize}`, value must be greater than 0")
         return False
@@ -30,11 +42,18 @@ def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool
         logging.info(f"Downloading from {url} to file {filePath.absolute()}")
 
     try:
-        requests.head(url, auth=auth, headers=headers)
+        head = requests.head(url, auth=auth, headers=headers, allow_redirects=True)
     except requests.exceptions.InvalidSchema as e:
         logging.error(f"Schema error: {e}")
         return False
 
+    if segments > 1:
+        fileSize = int(head.headers.get("Content-Length", 0))
+        if head.ok and head.headers.get("Accept-Ranges", "none").lower() == "bytes" and fileSize > 0:
+            return segmentedDownload(url, filePath, fileSize, segments, chunkSize, verbose, headers, auth, getValidators(head))
+
+        logging.info("Server does not support range requests, falling back to single stream download")
+
     with requests.get(url, stream=True, auth=auth, headers=headers) as stream:
         try:
             stream.raise_for_status()
@@ -60,6 +79,161 @@ def download(url: str, filePath: Path, chunkSize: int = 1024*1024, verbose: bool
 
     return True
 
+def getValidators(response: requests.Response) -> dict[str, str]:
+    return {validator.value: response.headers[validator.value] for validator in Validator if validator.value in response.headers}
+
+def conditionalDownload(url: str, filePath: Path, previousValidators: dict[str, str], previousFile: Path = None, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None, segments: int = 1) -> tuple[bool, bool, dict[str, str]]:
+    # Returns success, whether the upstream file changed, and the validators of the upstream file
+    conditionalHeaders = {}
+    if previousFile is not None and previousFile.exists():
+        if Validator.ETAG.value in previousValidators:
+            conditionalHeaders["If-None-Match"] = previousValidators[Validator.ETAG.value]
+        if Validator.LAST_MODIFIED.value in previousValidators:
+            conditionalHeaders["If-Modified-Since"] = previousValidators[Validator.LAST_MODIFIED.value]
+
+    try:
+        head = requests.head(url, auth=auth, headers=headers | conditionalHeaders, allow_redirects=True)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to check {url} for changes: {e}")
+        return False, True, {}
+
+    validators = getValidators(head)
+    unchanged = head.status_code == 304
+
+    if conditionalHeaders and not unchanged and head.ok and validators: # Server may ignore conditional headers, compare directly
+        unchanged = all(previousValidators.get(key) == value for key, value in validators.items())
+
+    if not unchanged:
+        return download(url, filePath, chunkSize, verbose, headers, auth, segments), True, validators
+
+    logging.info(f"Upstream file at {url} is unchanged, linking previous download {previousFile}")
+    filePath.unlink(missing_ok=True)
+    try:
+        filePath.hardlink_to(previousFile)
+    except OSError: # Filesystem does not support hard links, or crosses devices
+        shutil.copy2(previousFile, filePath)
+
+    return True, False, previousValidators | validators
+
+def segmentedDownload(url: str, filePath: Path, fileSize: int, segments: int, chunkSize: int = 1024*1024, verbose: bool = False, headers: dict = {}, auth: HTTPBasicAuth = None, validators: dict[str, str] = {}, checkpointSize: int = 16*1024*1024) -> bool:
+    # Partial files are kept in a sub folder so they are not picked up as task outputs
+    partialDir = filePath.parent / ".partial"
+    partialDir.mkdir(exist_ok=True)
+
+    partialPath = partialDir / filePath.name
+    progressPath = partialDir / f"{filePath.name}.progress"
+    progress = JsonSynchroniser(progressPath, journal=True) # Checkpoints are appended rather than rewriting the whole file
+
+    # Progress is stored as [start, end, bytes completed] per segment
+    if progress.get("url") != url or progress.get("size") != fileSize or progress.get("validators", {}) != validators or not partialPath.exists() or partialPath.stat().st_size != fileSize:
+        segmentSize = (fileSize / segments).__ceil__()
+        ranges = [[start, min(start + segmentSize, fileSize) - 1, 0] for start in range(0, fileSize, segmentSize)]
+
+        progress.clear()
+        progress |= {"url": url, "size": fileSize, "validators": validators, "segments": ranges}
+
+        with open(partialPath, "wb") as fp: # Preallocate full file so segments can be written in place
+            fp.truncate(fileSize)
+    else:
+        completed = sum(segment[2] for segment in progress["segments"])
+        logging.info(f"Resuming download of {filePath.name} with {completed}/{fileSize} bytes completed")
+
+    # Ranges are only served if the upstream file still matches, otherwise the full file is returned
+    ifRange = validators.get(Validator.ETAG.value, "")
+    if not ifRange or ifRange.startswith("W/"): # Weak etags can't be used for range requests
+        ifRange = validators.get(Validator.LAST_MODIFIED.value, "")
+
+    lock = threading.Lock()
+    cancelled = threading.Event()
+    changed = threading.Event()
+    if verbose:
+        progressBar = ProgressBar((fileSize / chunkSize).__ceil__(), processName="Downloading")
+        progressBar.update(sum(segment[2] for segment in progress["segments"]) // chunkSize)
+
+    def downloadSegment(index: int) -> bool:
+        start, end, completed = progress["segments"][index]
+        if start + completed > end:
+            return True
+
+        rangeHeaders = headers | {"Range": f"bytes={start + completed}-{end}"}
+        if ifRange:
+            rangeHeaders["If-Range"] = ifRange
+
+        with requests.get(url, stream=True, auth=auth, headers=rangeHeaders) as stream:
+            if stream.status_code == 200 and ifRange: # Full file returned as upstream no longer matches the partial file
+                changed.set()
+                cancelled.set()
+                return False
+
+            if stream.status_code != 206: # Server ignored range, writing would corrupt the file
+                logging.error(f"Expected partial content for segment {index}, received status code {stream.status_code}")
+                return False
+
+            with open(partialPath, "r+b") as fp:
+                fp.seek(start + completed)
+                checkpointed = completed
+
+                def checkpoint() -> None:
+                    # Bytes are only marked complete once they are on disk
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                    with lock:
+                        progress["segments"][index][2] = completed
+
+                try:
+                    for chunk in stream.iter_content(chunkSize):
+                        if cancelled.is_set():
+                            return False
+
+                        fp.write(chunk)
+                        completed += len(chunk)
+
+                        if completed - checkpointed >= checkpointSize:
+                            checkpoint()
+                            checkpointed = completed
+
+                        if verbose:
+                            with lock:
+                                progressBar.update(extraInfo=f"{segments} segments")
+                finally:
+                    if completed != checkpointed:
+                        checkpoint()
+
+        return start + completed > end
+
+    executor = cf.ThreadPoolExecutor(max_workers=segments)
+    futures = [executor.submit(downloadSegment, idx) for idx in range(len(progress["segments"]))]
+    try:
+        results = [future.result() for future in futures]
+    except (requests.exceptions.RequestException, KeyboardInterrupt) as e:
+        cancelled.set()
+        executor.shutdown(cancel_futures=True)
+        progress.close()
+        logging.error(f"Stopped downloading segments, progress saved for resuming: {type(e).__name__}")
+        return False
+
+    executor.shutdown()
+    if changed.is_set():
+        logging.error(f"Upstream file at {url} changed during download, discarding partial file to restart")
+        progress.delete()
+        partialPath.unlink(missing_ok=True)
+        return False
+
+    if not all(results):
+        progress.close()
+        logging.error("Failed to download all segments, progress saved for resuming")
+        return False
+
+    partialPath.replace(filePath)
+    progress.delete()
+
+    try:
+        partialDir.rmdir()
+    except OSError: # Other downloads still in progress
+        pass
+
+    return True
+
 def urlBuilder(url: str, parameters: dict) -> str:
     def encode(key: str, value: any) -> str:
         if isinstance(value, bool):
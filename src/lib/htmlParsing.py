@@ -0,0 +1,24 @@
+import re
+import html
+from enum import Enum
+from bs4 import BeautifulSoup, FeatureNotFound
+
+class SoupBackend(Enum):
+    BUILTIN = "html.parser"
+    LXML = "lxml"
+
+_ignoredPattern = re.compile(r"<!--.*?(?:-->|$)|<(script|style)\b.*?(?:</\1\s*>|$)", re.IGNORECASE | re.DOTALL)
+_hrefPattern = re.compile(r"""<a\s(?:[^>]*?\s)?href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+
+def extractLinks(content: str) -> list[str]:
+    # Directory indexes only need anchor targets, so links are matched directly instead of building a tree
+    # Anchors within comments and scripts are removed first as they are never part of the parsed document
+    content = _ignoredPattern.sub("", content)
+    return [html.unescape(doubleQuoted or singleQuoted or unquoted) for doubleQuoted, singleQuoted, unquoted in _hrefPattern.findall(content)]
+
+def getSoup(content: str | bytes, backend: SoupBackend = SoupBackend.LXML) -> BeautifulSoup:
+    # Structured pages keep the BeautifulSoup api, with tree building done by lxml unless requested otherwise
+    try:
+        return BeautifulSoup(content, backend.value)
+    except FeatureNotFound:
+        return BeautifulSoup(content, SoupBackend.BUILTIN.value)
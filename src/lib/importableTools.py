@@ -10,8 +10,8 @@ def extract(outputDir: Path, inputPath: Path):
     zp.extract(inputPath, outputDir)
 
 @importableScript()
-def xmlProcessor(outputDir: Path, inputPath: Path, outputFileName: str, entriesPerSection: int = 0):
-    xml.basicXMLProcessor(inputPath, outputDir / outputFileName, entriesPerSection)
+def xmlProcessor(outputDir: Path, inputPath: Path, outputFileName: str, entriesPerSection: int = 0, engine: str = xml.XMLEngine.ELEMENTTREE.value, include: list[str] = [], exclude: list[str] = [], workers: int = 1):
+    xml.basicXMLProcessor(inputPath, outputDir / outputFileName, entriesPerSection, engine=xml.XMLEngine(engine), include=include, exclude=exclude, workers=workers)
 
 @importableScript(inputCount=-1, separateInputArgs=False)
 def fileMerger(outputDir: Path, inputList: list[DataFile], outputFileName: str, chunkSize: int = 1024, deleteOld: bool = False):
@@ -1,101 +1,198 @@
 from pathlib import Path
 import json
+import os
+import hashlib
+from contextlib import contextmanager
+from typing import Iterator
 
 class _SyncObject:
-    def __init__(self, parent: '_SyncObject' = None):
+    def __init__(self, parent: '_SyncObject' = None, key: str | int = None):
         self._parent = parent
+        self._key = key
 
-    def _translate(self, item: any) -> any:
+    def _translate(self, item: any, key: str | int) -> any:
         if isinstance(item, list) and not isinstance(item, _SyncList):
-            return _SyncList(item, self)
-        
+            return _SyncList(item, self, key)
+
         if isinstance(item, dict) and not isinstance(item, _SyncDict):
-            return _SyncDict(item, self)
-        
+            return _SyncDict(item, self, key)
+
         return item
 
-    def _sync(self):
+    def _record(self, operation: str, path: list[str | int], value: any = None) -> None:
         if not self._parent:
             return
-        
-        self._parent._sync()
+
+        self._parent._record(operation, [self._key] + path, value)
 
 class _SyncList(_SyncObject, list):
-    def __init__(self, data: list, parent: '_SyncObject' = None):
-        list.__init__(self, self._listTranslate(data))
-        _SyncObject.__init__(self, parent)
-
-    def _listTranslate(self, data: list) -> list:
-        retVal = []
-        for item in data:
-            if isinstance(item, list) and not isinstance(item, _SyncList):
-                retVal.append(_SyncList(item, self))
-            elif isinstance(item, dict) and not isinstance(item, _SyncDict):
-                retVal.append(_SyncDict(item, self))
-            else:
-                retVal.append(item)
-
-        return retVal
-
-    def __setattr__(self, name: str, value: any) -> None:
-        list.__setattr__(self, name, self._translate(value))
-        self._sync()
+    def __init__(self, data: list, parent: '_SyncObject' = None, key: str | int = None):
+        _SyncObject.__init__(self, parent, key)
+        list.__init__(self, [self._translate(item, idx) for idx, item in enumerate(data)])
 
-    def __setitem__(self, key: str, value: any):
-        list.__setitem__(self, key, self._translate(value))
-        self._sync()
+    def __setitem__(self, key: int, value: any):
+        list.__setitem__(self, key, self._translate(value, key))
+        self._record("set", [key], value)
 
     def append(self, object: any) -> None:
-        super().append(self._translate(object))
-        self._sync()
+        super().append(self._translate(object, len(self)))
+        self._record("append", [], object)
 
     def extend(self, object: any) -> None:
-        super().extend(self._translate(object))
-        self._sync()
+        object = list(object)
+        super().extend([self._translate(item, len(self) + idx) for idx, item in enumerate(object)])
+        self._record("extend", [], object)
+
+_missing = object()
 
 class _SyncDict(_SyncObject, dict):
-    def __init__(self, data: dict, parent: '_SyncObject' = None):
-        dict.__init__(self, self._dictTranslate(data))
-        _SyncObject.__init__(self, parent)
-
-    def _dictTranslate(self, data: dict) -> dict:
-        retVal = {}
-        for key, value in data.items():
-            if isinstance(value, list) and not isinstance(value, _SyncList):
-                retVal[key] = _SyncList(value, self)
-            elif isinstance(value, dict) and not isinstance(value, _SyncDict):
-                retVal[key] = _SyncDict(value, self)
-            else:
-                retVal[key] = value
-
-        return retVal
+    def __init__(self, data: dict, parent: '_SyncObject' = None, key: str | int = None):
+        _SyncObject.__init__(self, parent, key)
+        dict.__init__(self, {subKey: self._translate(value, subKey) for subKey, value in data.items()})
 
     def __setitem__(self, key: str, value: any):
-        if key in dict(self) and dict(self).get(key) == value:
+        if dict.get(self, key, _missing) == value:
             return
 
-        super().__setitem__(key, self._translate(value))
-        self._sync()
+        super().__setitem__(key, self._translate(value, key))
+        self._record("set", [key], value)
 
     def __ior__(self, value: dict):
-        value = super().__ior__(self._translate(value))
-        self._sync()
-        return value
+        super().__ior__({key: self._translate(subValue, key) for key, subValue in value.items()})
+        self._record("update", [], dict(value))
+        return self
 
     def clear(self):
         super().clear()
-        super()._sync()
+        self._record("clear", [])
 
 class JsonSynchroniser(_SyncDict):
-    def __init__(self, filePath: Path):
+    # Every change rewrites the full file unless grouped with `batch`.
+    # With `journal` enabled changes are instead appended to a journal file, which is compacted into the main file on close.
+
+    _journalSuffix = ".journal"
+
+    def __init__(self, filePath: Path, journal: bool = False):
         self._path = filePath
+        self._journalPath = filePath.parent / f"{filePath.name}{self._journalSuffix}"
+        self._useJournal = journal
+
+        self._batchDepth = 0
+        self._dirty = False
+        self._pendingEntries: list[str] = []
+
+        data, self._baseDigest = self._load()
+        super().__init__(data)
+
+    def __enter__(self) -> 'JsonSynchroniser':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _load(self) -> tuple[dict, str]:
+        if not self._path.exists():
+            rawData = b""
+            data = {}
+        else:
+            with open(self._path, "rb") as fp:
+                rawData = fp.read()
+
+            data = json.loads(rawData)
+
+        digest = hashlib.md5(rawData).hexdigest()
+        if not self._journalPath.exists():
+            return data, digest
+
+        with open(self._journalPath) as fp:
+            header = fp.readline()
+            if not header or json.loads(header).get("base") != digest: # Journal was already compacted into file
+                self._journalPath.unlink()
+                return data, digest
+
+            for line in fp:
+                if not line.endswith("\n"): # Incomplete final entry from interrupted write
+                    break
+
+                self._replay(data, *json.loads(line))
+
+        return data, digest
+
+    def _replay(self, data: dict, operation: str, path: list[str | int], value: any) -> None:
+        target = data
+        if operation == "set":
+            path, key = path[:-1], path[-1]
+
+        for item in path:
+            target = target[item]
+
+        if operation == "set":
+            target[key] = value
+        elif operation == "append":
+            target.append(value)
+        elif operation == "extend":
+            target.extend(value)
+        elif operation == "update":
+            target.update(value)
+        elif operation == "clear":
+            target.clear()
+
+    def _record(self, operation: str, path: list[str | int], value: any = None) -> None:
+        if self._useJournal:
+            self._pendingEntries.append(json.dumps([operation, path, value]) + "\n")
+
+        self._dirty = True
+        if not self._batchDepth:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._dirty:
+            return
+
+        if self._useJournal:
+            newJournal = not self._journalPath.exists()
+            with open(self._journalPath, "a") as fp:
+                if newJournal:
+                    fp.write(json.dumps({"base": self._baseDigest}) + "\n")
+
+                fp.writelines(self._pendingEntries)
+
+            self._pendingEntries.clear()
+        else:
+            self._write()
+
+        self._dirty = False
+
+    def _write(self) -> None:
+        rawData = json.dumps(dict(self), indent=4).encode()
+        tempPath = self._path.parent / f".{self._path.name}.tmp"
+
+        with open(tempPath, "wb") as fp:
+            fp.write(rawData)
+
+        os.replace(tempPath, self._path) # Atomic so an interrupted write never leaves a corrupt file
+        self._baseDigest = hashlib.md5(rawData).hexdigest()
+
+    @contextmanager
+    def batch(self) -> Iterator['JsonSynchroniser']:
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if not self._batchDepth:
+                self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        if not self._journalPath.exists():
+            return
 
-        if not filePath.exists():
-            return super().__init__({})
-        
-        with open(filePath) as fp:
-            super().__init__(json.load(fp))
+        self._write()
+        self._journalPath.unlink()
 
-    def _sync(self) -> None:
-        with open(self._path, "w") as fp:
-            json.dump(dict(self), fp, indent=4)
+    def delete(self) -> None:
+        self._pendingEntries.clear()
+        self._dirty = False
+        self._path.unlink(missing_ok=True)
+        self._journalPath.unlink(missing_ok=True)
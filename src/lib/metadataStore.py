@@ -0,0 +1,329 @@
+import sqlite3
+import json
+import os
+import threading
+import logging
+from pathlib import Path
+from collections.abc import Mapping, MutableMapping
+from typing import Iterator
+from lib.settings import Settings
+from lib.json import JsonSynchroniser
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    UNIQUE (source, folder)
+);
+
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    step TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    success INTEGER NOT NULL DEFAULT 0,
+    last_success_start TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (run_id, step, idx)
+);
+
+CREATE INDEX IF NOT EXISTS steps_last_success ON steps (step, idx, last_success_start);
+
+CREATE TABLE IF NOT EXISTS outputs (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    step TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (run_id, step, idx, position)
+);
+
+CREATE TABLE IF NOT EXISTS crawl_pages (
+    crawl TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    directories TEXT NOT NULL,
+    files TEXT NOT NULL,
+    PRIMARY KEY (crawl, depth, url)
+);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    writer TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (writer, position)
+);
+
+CREATE TABLE IF NOT EXISTS properties (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+
+CREATE TABLE IF NOT EXISTS http_cache (
+    key TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    response TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS http_cache_accessed ON http_cache (accessed);
+"""
+
+class MetadataStore:
+
+    _fileName = "metadata.db"
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(_schema)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections can't be shared between threads or forked processes, so one is kept for each
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL") # Allow concurrent readers alongside a writer
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+
+            self._local.connection = connection
+            self._local.pid = pid
+
+        return self._local.connection
+
+    def query(self, query: str, parameters: tuple = ()) -> list[tuple]:
+        return self._connection().execute(query, parameters).fetchall()
+
+    def execute(self, query: str, parameters: tuple = ()) -> None:
+        with self._connection() as connection: # Commits on exit
+            connection.execute(query, parameters)
+
+    def executeMany(self, query: str, parameters: list[tuple]) -> None:
+        with self._connection() as connection:
+            connection.executemany(query, parameters)
+
+    def key(self, path: Path) -> str:
+        # Paths within the data directory are stored relative to it so data can be relocated
+        path = path.resolve()
+        try:
+            return str(path.relative_to(self.path.parent.resolve()))
+        except ValueError:
+            return str(path)
+
+    def runMetadata(self, source: str, folder: Path) -> 'RunMetadata':
+        return RunMetadata(self, source, folder)
+
+    def crawlProgress(self, progressPath: Path) -> 'CrawlProgress':
+        return CrawlProgress(self, progressPath)
+
+    def writerMetadata(self, workingDir: Path) -> 'WriterMetadata':
+        return WriterMetadata(self, workingDir)
+
+    def lastSuccessfulStep(self, source: str, step: str, index: int, excludeFolder: str = "") -> tuple[str, dict]:
+        rows = self.query(
+            "SELECT runs.folder FROM steps JOIN runs ON runs.id = steps.run_id "
+            "WHERE runs.source = ? AND runs.folder != ? AND steps.step = ? AND steps.idx = ? AND steps.success = 1 "
+            "ORDER BY runs.folder DESC LIMIT 1",
+            (source, excludeFolder or "", step, index)
+        )
+
+        if not rows:
+            return "", {}
+
+        folder = rows[0][0]
+        return folder, RunMetadata(self, source, folder, False).getStep(step, index)
+
+    def lastSuccessStart(self, source: str, step: str, index: int) -> str | None:
+        rows = self.query(
+            "SELECT steps.last_success_start FROM steps JOIN runs ON runs.id = steps.run_id "
+            "WHERE runs.source = ? AND steps.step = ? AND steps.idx = ? AND steps.last_success_start IS NOT NULL "
+            "ORDER BY runs.folder DESC LIMIT 1",
+            (source, step, index)
+        )
+
+        return rows[0][0] if rows else None
+
+class StoreDict(MutableMapping):
+    # Values are stored as json, so nested values must be reassigned to persist changes
+
+    def __init__(self, store: MetadataStore, namespace: str):
+        self._store = store
+        self._namespace = namespace
+
+    def __getitem__(self, key: str) -> any:
+        rows = self._store.query("SELECT value FROM properties WHERE namespace = ? AND key = ?", (self._namespace, key))
+        if not rows:
+            raise KeyError(key)
+
+        return json.loads(rows[0][0])
+
+    def __setitem__(self, key: str, value: any) -> None:
+        self._store.execute("INSERT OR REPLACE INTO properties (namespace, key, value) VALUES (?, ?, ?)", (self._namespace, key, json.dumps(value)))
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+
+        self._store.execute("DELETE FROM properties WHERE namespace = ? AND key = ?", (self._namespace, key))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self._store.query("SELECT key FROM properties WHERE namespace = ? ORDER BY key", (self._namespace,))])
+
+    def __len__(self) -> int:
+        return self._store.query("SELECT COUNT(*) FROM properties WHERE namespace = ?", (self._namespace,))[0][0]
+
+    def clear(self) -> None:
+        self._store.execute("DELETE FROM properties WHERE namespace = ?", (self._namespace,))
+
+class RunMetadata(Mapping):
+
+    _legacyFileName = "metadata.json"
+
+    # Mirrors keys of tasks.Metadata
+    _outputs = "outputs"
+    _success = "success"
+    _lastSuccessStart = "last success started"
+
+    def __init__(self, store: MetadataStore, source: str, folder: Path | str, importLegacy: bool = True):
+        self._store = store
+        self.folderName = Path(folder).name
+
+        self._store.execute("INSERT OR IGNORE INTO runs (source, folder) VALUES (?, ?)", (source, self.folderName))
+        self._runID = self._store.query("SELECT id FROM runs WHERE source = ? AND folder = ?", (source, self.folderName))[0][0]
+
+        legacyPath = Path(folder) / self._legacyFileName
+        if importLegacy and not len(self) and legacyPath.exists():
+            logging.info(f"Importing legacy metadata file {legacyPath}")
+            for step, stepData in JsonSynchroniser(legacyPath).items():
+                for index, data in enumerate(stepData):
+                    self.updateStep(step, index, dict(data))
+
+    def __getitem__(self, step: str) -> list[dict]:
+        indexes = [row[0] for row in self._store.query("SELECT idx FROM steps WHERE run_id = ? AND step = ? ORDER BY idx", (self._runID, step))]
+        if not indexes:
+            raise KeyError(step)
+
+        return [self.getStep(step, index) for index in indexes]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self._store.query("SELECT DISTINCT step FROM steps WHERE run_id = ?", (self._runID,))])
+
+    def __len__(self) -> int:
+        return self._store.query("SELECT COUNT(DISTINCT step) FROM steps WHERE run_id = ?", (self._runID,))[0][0]
+
+    def getStep(self, step: str, index: int) -> dict:
+        rows = self._store.query("SELECT data FROM steps WHERE run_id = ? AND step = ? AND idx = ?", (self._runID, step, index))
+        if not rows:
+            return {}
+
+        outputs = self._store.query("SELECT name FROM outputs WHERE run_id = ? AND step = ? AND idx = ? ORDER BY position", (self._runID, step, index))
+        return json.loads(rows[0][0]) | {self._outputs: [row[0] for row in outputs]}
+
+    def updateStep(self, step: str, index: int, metadata: dict) -> None:
+        data = self.getStep(step, index) | metadata
+        outputs = data.pop(self._outputs, [])
+
+        with self._store._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO steps (run_id, step, idx, success, last_success_start, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._runID, step, index, bool(data.get(self._success, False)), data.get(self._lastSuccessStart, None), json.dumps(data))
+            )
+            connection.execute("DELETE FROM outputs WHERE run_id = ? AND step = ? AND idx = ?", (self._runID, step, index))
+            connection.executemany(
+                "INSERT INTO outputs (run_id, step, idx, position, name) VALUES (?, ?, ?, ?, ?)",
+                [(self._runID, step, index, position, name) for position, name in enumerate(outputs)]
+            )
+
+class CrawlProgress:
+
+    _dirStr = "directories"
+    _fileStr = "files"
+
+    _metaSettings = "settings"
+    _metaProgress = "progress"
+
+    def __init__(self, store: MetadataStore, progressPath: Path):
+        self._store = store
+        self._key = store.key(progressPath)
+        self.settings = StoreDict(store, f"crawl:{self._key}")
+
+        if progressPath.exists() and not self.settings and not self.getDepths():
+            logging.info(f"Importing legacy crawler progress file {progressPath}")
+            legacy = JsonSynchroniser(progressPath)
+            self.settings.update(legacy.get(self._metaSettings, {}))
+            for pageData in legacy.get(self._metaProgress, []):
+                self.addDepth(pageData)
+
+    def getDepths(self) -> list[dict[str, dict[str, list[str]]]]:
+        depths: list[dict] = []
+        for depth, url, directories, files in self._store.query("SELECT depth, url, directories, files FROM crawl_pages WHERE crawl = ? ORDER BY depth, rowid", (self._key,)):
+            while len(depths) <= depth:
+                depths.append({})
+
+            depths[depth][url] = {self._dirStr: json.loads(directories), self._fileStr: json.loads(files)}
+
+        return depths
+
+    def addDepth(self, pageData: dict[str, dict[str, list[str]]]) -> None:
+        depth = self._store.query("SELECT COALESCE(MAX(depth) + 1, 0) FROM crawl_pages WHERE crawl = ?", (self._key,))[0][0]
+        self._store.executeMany(
+            "INSERT OR REPLACE INTO crawl_pages (crawl, depth, url, directories, files) VALUES (?, ?, ?, ?, ?)",
+            [(self._key, depth, url, json.dumps(links.get(self._dirStr, [])), json.dumps(links.get(self._fileStr, []))) for url, links in pageData.items()]
+        )
+
+    def clear(self) -> None:
+        self.settings.clear()
+        self._store.execute("DELETE FROM crawl_pages WHERE crawl = ?", (self._key,))
+
+class WriterMetadata(StoreDict):
+
+    _legacyFileName = "metadata.json"
+    _legacyFileNames = "fileNames"
+
+    def __init__(self, store: MetadataStore, workingDir: Path):
+        self._writerKey = store.key(workingDir)
+        super().__init__(store, f"writer:{self._writerKey}")
+
+        legacyPath = workingDir / self._legacyFileName
+        if legacyPath.exists() and not len(self) and not self.getChunks():
+            logging.info(f"Importing legacy writer metadata file {legacyPath}")
+            legacy = dict(JsonSynchroniser(legacyPath))
+            for fileName in legacy.pop(self._legacyFileNames, []):
+                self.addChunk(fileName)
+
+            self.update(legacy)
+
+    def getChunks(self) -> list[str]:
+        return [row[0] for row in self._store.query("SELECT name FROM chunks WHERE writer = ? ORDER BY position", (self._writerKey,))]
+
+    def addChunk(self, name: str) -> None:
+        self._store.execute(
+            "INSERT INTO chunks (writer, position, name) SELECT ?, COALESCE(MAX(position) + 1, 0), ? FROM chunks WHERE writer = ?",
+            (self._writerKey, name, self._writerKey)
+        )
+
+    def clearChunks(self) -> None:
+        self._store.execute("DELETE FROM chunks WHERE writer = ?", (self._writerKey,))
+
+    def clear(self) -> None:
+        super().clear()
+        self.clearChunks()
+
+_stores: dict[Path, MetadataStore] = {}
+
+def getStore(dataDir: Path = None) -> MetadataStore:
+    if dataDir is None:
+        dataDir = Path(Settings().Storage.DATA)
+
+    path = dataDir / MetadataStore._fileName
+    if path not in _stores:
+        _stores[path] = MetadataStore(path)
+
+    return _stores[path]
@@ -6,7 +6,12 @@ import logging
 import pyarrow.parquet as pq
 from typing import Iterator
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import operator
 import shutil
+import re
 
 class DataFormat(Enum):
     CSV     = ".csv"
@@ -19,6 +24,15 @@ class DataProperty(Enum):
     SEPERATOR = "sep"
     ENCODING  = "encoding"
     HEADER    = "header"
+    SCHEMA    = "schema"
+    ENGINE    = "engine"
+    BLOCKSIZE = "blockSize"
+
+Filter = tuple[str, str, any] # (column, operator, value), a list of filters must all be satisfied
+
+class DataEngine(Enum):
+    PANDAS = "pandas"
+    ARROW  = "arrow"
 
 class FileObject:
     def __init__(self, path: Path):
@@ -86,10 +100,16 @@ class DataFile(FileObject):
         
         return super().__new__(subclassMap[subclass])
 
+    def __getnewargs__(self) -> tuple[Path]: # Allows pickling for use in worker processes
+        return (self.path,)
+
     def __init__(self, path: Path, properties: dict = {}):
         super().__init__(path)
 
         self.properties: dict[DataProperty, any] = {}
+        self.updateProperties(properties)
+
+    def updateProperties(self, properties: dict) -> None:
         for property, value in properties.items():
             dataProperty = DataProperty._value2member_map_.get(property, None)
             if dataProperty is None:
@@ -98,10 +118,16 @@ class DataFile(FileObject):
 
             self.properties[dataProperty.value] = value
 
-    def read(self, **kwargs: dict) -> pd.DataFrame:
+    def read(self, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> pd.DataFrame:
+        raise NotImplementedError
+    
+    def readIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pd.DataFrame]:
         raise NotImplementedError
     
-    def readIterator(self, chunkSize: int, **kwargs: dict) -> Iterator[pd.DataFrame]:
+    def supportsArrow(self, **kwargs: dict) -> bool:
+        return False
+    
+    def readArrowIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pa.Table]:
         raise NotImplementedError
     
     def write(self, df: pd.DataFrame, **kwargs: dict) -> None:
@@ -117,12 +143,87 @@ class CSVFile(DataFile):
     
     format = DataFormat.CSV
 
-    def read(self, **kwargs: dict) -> pd.DataFrame:
-        return pd.read_csv(self.path, **(self.properties | kwargs))
+    _pandasProperties = (DataProperty.SEPERATOR, DataProperty.ENCODING, DataProperty.HEADER)
+    _arrowKwargs = ("low_memory", "dtype", "on_bad_lines") # Pandas read arguments with an arrow equivalent
+    _defaultBlockSize = 1024 * 1024 * 16
+
+    def _readProperties(self) -> dict:
+        return {property.value: self.properties[property.value] for property in self._pandasProperties if property.value in self.properties}
+
+    def _arrowOptions(self, **kwargs: dict) -> tuple[pacsv.ReadOptions, pacsv.ParseOptions] | None:
+        if self.properties.get(DataProperty.ENGINE.value, DataEngine.PANDAS.value) != DataEngine.ARROW.value:
+            return None
+        
+        if any(kwarg not in self._arrowKwargs for kwarg in kwargs):
+            return None
+        
+        if kwargs.get("dtype", object) not in (object, str) or kwargs.get("on_bad_lines", "error") not in ("error", "skip"):
+            return None
+        
+        seperator = self.properties.get(DataProperty.SEPERATOR.value, ",")
+        header = self.properties.get(DataProperty.HEADER.value, "infer")
+        if header == "infer":
+            header = 0
+
+        if len(seperator) != 1 or not isinstance(header, int) or isinstance(header, bool): # Regex seperators and multi-line headers are pandas only
+            return None
+
+        readOptions = pacsv.ReadOptions(
+            skip_rows=header,
+            encoding=self.properties.get(DataProperty.ENCODING.value, "utf8"),
+            block_size=self.properties.get(DataProperty.BLOCKSIZE.value, self._defaultBlockSize),
+            use_threads=True
+        )
+
+        parseOptions = pacsv.ParseOptions(
+            delimiter=seperator,
+            newlines_in_values=True,
+            invalid_row_handler=(lambda _: "skip") if kwargs.get("on_bad_lines") == "skip" else None
+        )
+
+        return readOptions, parseOptions
+
+    def _arrowReader(self, columns: list[str] = None, **kwargs: dict) -> pacsv.CSVStreamingReader:
+        readOptions, parseOptions = self._arrowOptions(**kwargs)
+
+        # Read every column as a string so types inferred from the first block can't conflict with later blocks
+        if columns is None:
+            columns = pacsv.open_csv(self.path, read_options=readOptions, parse_options=parseOptions).schema.names
+
+        convertOptions = pacsv.ConvertOptions(column_types={column: pa.string() for column in columns}, include_columns=columns, strings_can_be_null=True)
+        return pacsv.open_csv(self.path, read_options=readOptions, parse_options=parseOptions, convert_options=convertOptions)
+
+    def read(self, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> pd.DataFrame:
+        if self.supportsArrow(**kwargs):
+            table = self._arrowReader(readColumns(columns, filters), **kwargs).read_all()
+            return tableToDataFrame(selectTable(table, columns, filters))
+
+        df = pd.read_csv(self.path, **(self._readProperties() | {"usecols": readColumns(columns, filters)} | kwargs))
+        return selectDataFrame(df, columns, filters)
     
-    def readIterator(self, chunkSize: int, **kwargs) -> Iterator[pd.DataFrame]:
-        for chunk in self.read(chunksize=chunkSize, **kwargs):
+    def readIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs) -> Iterator[pd.DataFrame]:
+        if self.supportsArrow(**kwargs):
+            for table in self.readArrowIterator(chunkSize, columns, filters, **kwargs):
+                yield tableToDataFrame(table)
+            return
+
+        for chunk in pd.read_csv(self.path, chunksize=chunkSize, **(self._readProperties() | {"usecols": readColumns(columns, filters)} | kwargs)):
+            chunk = selectDataFrame(chunk, columns, filters)
+            if filters and chunk.empty:
+                continue
+
             yield chunk
+
+    def supportsArrow(self, **kwargs: dict) -> bool:
+        return self._arrowOptions(**kwargs) is not None
+
+    def readArrowIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pa.Table]:
+        for table in rebatch(self._arrowReader(readColumns(columns, filters), **kwargs), chunkSize):
+            table = selectTable(table, columns, filters)
+            if filters and not table.num_rows:
+                continue
+
+            yield table
     
     def write(self, df: pd.DataFrame, **kwargs: dict) -> None:
         df.to_csv(self.path, **kwargs)
@@ -133,6 +234,10 @@ class CSVFile(DataFile):
             self.write(chunk, header=columns if idx == 0 else False, mode="a", **kwargs)
 
     def getColumns(self) -> list[str]:
+        if self.supportsArrow():
+            readOptions, parseOptions = self._arrowOptions()
+            return pacsv.open_csv(self.path, read_options=readOptions, parse_options=parseOptions).schema.names
+
         df = self.read(nrows=1)
         if df is None:
             return []
@@ -149,28 +254,89 @@ class ParquetFile(DataFile):
     
     format = DataFormat.PARQUET
 
-    def read(self, **kwargs: dict) -> pd.DataFrame:
-        return pq.read_table(self.path, **kwargs).to_pandas()
+    _pandasKwargs = ("low_memory", "dtype", "on_bad_lines") # Csv reading arguments that have no meaning for parquet
+
+    def _parquetKwargs(self, kwargs: dict) -> dict:
+        return {key: value for key, value in kwargs.items() if key not in self._pandasKwargs}
+
+    def read(self, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> pd.DataFrame:
+        return pq.read_table(self.path, columns=columns, filters=filters, **self._parquetKwargs(kwargs)).to_pandas()
     
-    def readIterator(self, chunkSize: int, **kwargs) -> Iterator[pd.DataFrame]:
-        pf = pq.ParquetFile(self.path, memory_map=True)
-        for batch in pf.iter_batches(chunkSize, **kwargs):
-            yield batch.to_pandas()
+    def readIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs) -> Iterator[pd.DataFrame]:
+        for table in self.readArrowIterator(chunkSize, columns, filters, **kwargs):
+            yield table.to_pandas()
+
+    def supportsArrow(self, **kwargs: dict) -> bool:
+        return True
+
+    def readArrowIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pa.Table]:
+        if not filters:
+            pf = pq.ParquetFile(self.path, memory_map=True)
+            for batch in pf.iter_batches(chunkSize, columns=columns, **self._parquetKwargs(kwargs)):
+                yield pa.Table.from_batches([batch])
+            return
+
+        # Datasets skip row groups whose statistics can't satisfy the filters
+        dataset = ds.dataset(self.path, format="parquet")
+        for batch in dataset.to_batches(columns=columns, filter=pq.filters_to_expression(filters), batch_size=chunkSize, **self._parquetKwargs(kwargs)):
+            if batch.num_rows:
+                yield pa.Table.from_batches([batch])
+
+    def getSchemaOverrides(self) -> dict[str, pa.DataType]:
+        overrides = {}
+        for column, typeName in self.properties.get(DataProperty.SCHEMA.value, {}).items():
+            if isinstance(typeName, pa.DataType): # Nested types have no alias so are given directly
+                overrides[column] = typeName
+                continue
+
+            try:
+                overrides[column] = pa.type_for_alias(typeName)
+            except ValueError:
+                raise Exception(f"Unknown type '{typeName}' for column '{column}' in schema") from AttributeError
+
+        return overrides
 
     def write(self, df: pd.DataFrame, **kwargs: dict) -> None:
-        df.where(pd.notnull(df), "").astype(str).to_parquet(self.path, "pyarrow")
+        overrides = self.getSchemaOverrides()
+        schema = pa.schema([(str(column), overrides.get(str(column), inferType(df[column]))) for column in df.columns]) # Empty columns stay null so other chunks decide their type when combined
+
+        table = dataframeToTable(df, schema)
+        pq.write_table(table, self.path, use_dictionary=dictionaryColumns(table))
 
     def writeIterator(self, iterator: Iterator[pd.DataFrame], columns: list[str], **kwargs: dict) -> None:
-        schema = pa.schema([(column, pa.string()) for column in columns])
-        with pq.ParquetWriter(self.path, schema=schema) as writer:
-            for chunk in iterator:
-                chunk = chunk.reindex(columns=columns).astype(str)
-                writer.write_table(pa.Table.from_pandas(chunk))
+        # Later chunks are unknown when the schema is created, so only overridden columns are typed
+        overrides = self.getSchemaOverrides()
+        schema = pa.schema([(column, overrides.get(column, pa.string())) for column in columns])
+        self.writeTables((dataframeToTable(chunk.reindex(columns=columns), schema) for chunk in iterator), schema)
+
+    def writeTables(self, iterator: Iterator[pa.Table], schema: pa.Schema) -> None:
+        writer = None
+        try:
+            for table in iterator:
+                table = alignTable(table, schema)
+                if writer is None: # Dictionary encoded columns are chosen from the first table
+                    writer = pq.ParquetWriter(self.path, schema=schema, use_dictionary=dictionaryColumns(table))
+
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is None:
+            pq.write_table(schema.empty_table(), self.path)
+
+    def readTables(self) -> Iterator[pa.Table]:
+        pf = pq.ParquetFile(self.path, memory_map=True)
+        for rowGroup in range(pf.num_row_groups):
+            yield pf.read_row_group(rowGroup)
 
     def getColumns(self) -> list[str]:
         pf = pq.read_schema(self.path)
         return pf.names
 
+    def getSchema(self) -> pa.Schema:
+        return pq.read_schema(self.path)
+
 class Folder(FileObject):
     def __init__(self, path: Path, create: bool = False):
         super().__init__(path)
@@ -216,21 +382,55 @@ class StackedFile(Folder, DataFile):
 
         self._sectionFormat = sectionFormat
 
-    def _getFiles(self) -> list[DataFile]:
-        return [dataFile for dataFile in [DataFile(file) for file in self.path.iterdir() if file.is_file()] if dataFile.format == self._sectionFormat]
+    def _getFiles(self) -> list['DataFile | ParquetDataset']:
+        sections = []
+        for path in self.path.iterdir():
+            if path.name.startswith("."): # Sections still being written
+                continue
+
+            if path.is_file():
+                dataFile = DataFile(path)
+                if dataFile.format == self._sectionFormat:
+                    sections.append(dataFile)
+
+            elif any(path.glob(f"*{DataFormat.PARQUET.value}")): # Section written directly as parquet parts
+                sections.append(ParquetDataset(path))
+
+        return sections
 
-    def read(self, **kwargs: dict) -> pd.DataFrame:
-        dfs = {file.path.stem: file.read(**kwargs) for file in self._getFiles()}
-        return pd.concat(dfs.values(), axis=1, keys=dfs.keys())
+    def _getSections(self, columns: list[tuple[str, str]] | None) -> dict[DataFile, list[str] | None]:
+        # Columns of stacked files are (section, column) pairs, sections without requested columns are not read
+        if columns is None:
+            return {file: None for file in self._getFiles()}
+
+        sections = {}
+        for file in self._getFiles():
+            sectionColumns = [column for section, column in columns if section == file.path.stem]
+            if sectionColumns:
+                sections[file] = sectionColumns
+
+        return sections
+
+    def read(self, columns: list[tuple[str, str]] = None, filters: list[Filter] = None, **kwargs: dict) -> pd.DataFrame:
+        sections = self._getSections(readColumns(columns, filters))
+        dfs = {file.path.stem: file.read(sectionColumns, **kwargs) for file, sectionColumns in sections.items()}
+        return selectDataFrame(pd.concat(dfs.values(), axis=1, keys=dfs.keys()), columns, filters)
     
-    def readIterator(self, chunkSize, **kwargs: dict) -> Iterator[pd.DataFrame]:
-        sections = {file.path.stem: file.readIterator(chunkSize, **kwargs) for file in self._getFiles()}
+    def readIterator(self, chunkSize, columns: list[tuple[str, str]] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pd.DataFrame]:
+        # Rows are only filtered once sections are joined, so each section stays aligned
+        sections = {file.path.stem: file.readIterator(chunkSize, sectionColumns, **kwargs) for file, sectionColumns in self._getSections(readColumns(columns, filters)).items()}
         while True:
             try:
-                yield pd.concat([next(chunk) for chunk in sections.values()], axis=1, keys=sections.keys())
+                df = pd.concat([next(chunk) for chunk in sections.values()], axis=1, keys=sections.keys())
             except StopIteration:
                 return
             
+            df = selectDataFrame(df, columns, filters)
+            if filters and df.empty:
+                continue
+
+            yield df
+            
     def write(self, df: pd.DataFrame, **kwargs: dict) -> None:
         for outerColumn in df.columns.levels[0]:
             dataFile = DataFile(self.path / f"{outerColumn}{self._sectionFormat.value}")
@@ -239,6 +439,54 @@ class StackedFile(Folder, DataFile):
     def getColumns(self) -> dict[str, list[str]]:
         return {file.path.stem: file.getColumns() for file in self._getFiles()}
 
+class ParquetDataset(Folder):
+    # Folder of parquet files holding consecutive parts of a single table, ordered by the number ending each file name
+
+    format = DataFormat.PARQUET
+
+    def _getParts(self) -> list[ParquetFile]:
+        def partNumber(part: ParquetFile) -> int:
+            match = re.search(r"\d+$", part.path.stem)
+            return int(match.group()) if match else -1
+
+        return sorted([DataFile(path) for path in self.path.glob(f"*{DataFormat.PARQUET.value}")], key=partNumber)
+
+    def getColumns(self) -> list[str]:
+        columns = {}
+        for part in self._getParts():
+            columns |= {column: None for column in part.getColumns()}
+
+        return list(columns)
+    
+    def getSchema(self, columns: list[str] = None) -> pa.Schema:
+        schema = unifySchemas([part.getSchema() for part in self._getParts()], self.getColumns())
+        if columns is None:
+            return schema
+        
+        return pa.schema([schema.field(column) for column in columns])
+    
+    def read(self, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> pd.DataFrame:
+        schema = self.getSchema(columns)
+        tables = []
+        for part in self._getParts():
+            partColumns = part.getColumns()
+            table = pq.read_table(part.path, columns=[column for column in schema.names if column in partColumns], filters=filters)
+            tables.append(alignTable(table, schema))
+
+        return (pa.concat_tables(tables) if tables else schema.empty_table()).to_pandas()
+    
+    def readIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pd.DataFrame]:
+        for table in self.readArrowIterator(chunkSize, columns, filters, **kwargs):
+            yield table.to_pandas()
+
+    def readArrowIterator(self, chunkSize: int, columns: list[str] = None, filters: list[Filter] = None, **kwargs: dict) -> Iterator[pa.Table]:
+        # Parts of sibling datasets hold the same rows, so batching each part separately keeps batches aligned between datasets
+        schema = self.getSchema(columns)
+        for part in self._getParts():
+            partColumns = part.getColumns()
+            for table in part.readArrowIterator(chunkSize, [column for column in schema.names if column in partColumns], filters, **kwargs):
+                yield alignTable(table, schema)
+
 def moveDataFile(inputFile: DataFile, outputFile: DataFile):
     if inputFile.format == outputFile.format:
         inputFile.rename(outputFile.path)
@@ -248,3 +496,147 @@ def moveDataFile(inputFile: DataFile, outputFile: DataFile):
     iterator = inputFile.readIterator(1024 * 16)
     outputFile.writeIterator(iterator, inputFile.getColumns(), index=False)
     inputFile.delete()
+
+_typeLattice = [pa.null(), pa.int64(), pa.float64(), pa.string()]
+
+def inferType(series: pd.Series) -> pa.DataType:
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if inferred == "empty":
+        return pa.null()
+    
+    if inferred == "integer":
+        return pa.int64()
+    
+    if inferred in ("floating", "mixed-integer-float", "decimal"):
+        return pa.float64()
+    
+    return pa.string()
+
+def promoteType(currentType: pa.DataType, newType: pa.DataType) -> pa.DataType:
+    if currentType == newType or pa.types.is_null(newType):
+        return currentType
+    
+    if pa.types.is_null(currentType):
+        return newType
+    
+    if currentType in _typeLattice and newType in _typeLattice:
+        return max(currentType, newType, key=_typeLattice.index)
+    
+    return pa.string() # Unrelated types can always be represented as strings
+
+def unifySchemas(schemas: list[pa.Schema], columns: list[str], overrides: dict[str, pa.DataType] = {}) -> pa.Schema:
+    columnTypes = {column: pa.null() for column in columns}
+    for schema in schemas:
+        for field in schema:
+            if field.name in columnTypes:
+                columnTypes[field.name] = promoteType(columnTypes[field.name], field.type)
+
+    columnTypes |= {column: dataType for column, dataType in overrides.items() if column in columnTypes}
+    return pa.schema([(column, pa.string() if pa.types.is_null(columnType) else columnType) for column, columnType in columnTypes.items()])
+
+def seriesToArray(series: pd.Series, dataType: pa.DataType) -> pa.Array:
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if inferred == "empty":
+        return pa.nulls(len(series), dataType)
+
+    if pa.types.is_nested(dataType): # Lists, structs and maps are built directly from the python objects
+        return pa.array(series, dataType, from_pandas=True)
+
+    if inferred == "integer":
+        array = pa.array(series, pa.int64(), from_pandas=True)
+    elif inferred in ("floating", "mixed-integer-float", "decimal"):
+        array = pa.array(series.astype("float64"), pa.float64(), from_pandas=True)
+    else:
+        array = pa.array(series if inferred == "string" else series.map(str, na_action="ignore"), pa.string(), from_pandas=True)
+
+    return array if array.type == dataType else array.cast(dataType)
+
+def dataframeToTable(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    return pa.Table.from_arrays([seriesToArray(df[column], field.type) for column, field in zip(df.columns, schema)], schema=schema)
+
+def dictionaryColumns(table: pa.Table, maxUniqueRatio: float = 0.1) -> list[str]:
+    if not table.num_rows:
+        return []
+    
+    return [field.name for field in table.schema if pa.types.is_string(field.type) and pc.count_distinct(table.column(field.name)).as_py() <= table.num_rows * maxUniqueRatio]
+
+def rebatch(batches: Iterator[pa.RecordBatch], chunkSize: int) -> Iterator[pa.Table]:
+    # Slices are zero-copy, so batches are regrouped into tables of exactly chunkSize rows without copying data
+    pending: list[pa.RecordBatch] = []
+    pendingRows = 0
+
+    for batch in batches:
+        while batch.num_rows:
+            rows = min(chunkSize - pendingRows, batch.num_rows)
+            pending.append(batch.slice(0, rows))
+            pendingRows += rows
+            batch = batch.slice(rows)
+
+            if pendingRows == chunkSize:
+                yield pa.Table.from_batches(pending)
+                pending.clear()
+                pendingRows = 0
+
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+def readColumns(columns: list[str] | None, filters: list[Filter] | None) -> list[str] | None:
+    if columns is None:
+        return None
+    
+    return columns + [column for column, _, _ in (filters or []) if column not in columns]
+
+_filterOperators = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+def filterMask(df: pd.DataFrame, filters: list[Filter]) -> pd.Series:
+    mask = pd.Series(True, index=df.index)
+    for column, filterOperator, value in filters:
+        if filterOperator == "in":
+            mask &= df[column].isin(value)
+        elif filterOperator == "not in":
+            mask &= ~df[column].isin(value)
+        elif filterOperator in _filterOperators:
+            mask &= _filterOperators[filterOperator](df[column], value)
+        else:
+            raise Exception(f"Unknown filter operator '{filterOperator}'") from AttributeError
+
+    return mask
+
+def selectDataFrame(df: pd.DataFrame, columns: list[str] | None, filters: list[Filter] | None) -> pd.DataFrame:
+    if filters:
+        df = df[filterMask(df, filters)]
+
+    if columns is not None:
+        df = df[columns]
+
+    return df
+
+def selectTable(table: pa.Table, columns: list[str] | None, filters: list[Filter] | None) -> pa.Table:
+    if filters:
+        table = table.filter(pq.filters_to_expression(filters))
+
+    if columns is not None:
+        table = table.select(columns)
+
+    return table
+
+def tableToDataFrame(table: pa.Table) -> pd.DataFrame:
+    return table.to_pandas(split_blocks=True, self_destruct=True) # Frees arrow buffers as columns are converted
+
+def alignTable(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.chunked_array([pa.nulls(table.num_rows, field.type)]))
+
+    return pa.Table.from_arrays(columns, schema=schema)
@@ -142,23 +142,61 @@ class Map:
 
         logging.info(f"Saved map data to local file: {filePath}")
 
-    def applyTo(self, df: pd.DataFrame) -> dict[str, pd.DataFrame]:
-        eventCollections: dict[str, list[pd.Series]] = {}
+    def compile(self, columns: list[str]) -> 'MapPlan':
+        eventColumns: dict[str, tuple[list[str], list[str]]] = {}
+        eventFallbacks: dict[str, list[tuple[int, list[str]]]] = {}
 
-        for column in df.columns:
+        for column in columns:
             event, newName, fallbacks = self.translation.get(column, (self._unmappedLabel, f"{self.unmappedPrefix}{'_' if self.unmappedPrefix else ''}{column}", []))
 
-            if event not in eventCollections:
-                eventCollections[event] = []
+            if event not in eventColumns:
+                eventColumns[event] = ([], [])
+                eventFallbacks[event] = []
 
-            series = df[column]
-            for fallback in fallbacks:
-                if fallback in df.columns:
-                    series = series.fillna(df[fallback])
+            sources, names = eventColumns[event]
+            presentFallbacks = [fallback for fallback in fallbacks if fallback in columns]
+            if presentFallbacks:
+                eventFallbacks[event].append((len(sources), presentFallbacks))
+
+            sources.append(column)
+            names.append(newName)
+
+        return MapPlan(columns, eventColumns, eventFallbacks)
 
-            eventCollections[event].append(series.rename(newName))
+    def applyTo(self, df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+        return self.compile(list(df.columns)).applyTo(df)
+
+    def referencedColumns(self) -> list[str]:
+        columns = []
+        for originalName, (_, _, fallbacks) in self.translation.items():
+            columns = cmn.extendUnique(columns, [originalName] + fallbacks)
 
-        return {event: pd.concat(seriesList, axis=1) for event, seriesList in eventCollections.items()}
+        return columns
 
     def isEmpty(self) -> bool:
         return not self.translation
+
+class MapPlan:
+    def __init__(self, columns: list[str], eventColumns: dict[str, tuple[list[str], list[str]]], eventFallbacks: dict[str, list[tuple[int, list[str]]]]):
+        self.columns = columns
+        self._eventColumns = eventColumns
+        self._eventFallbacks = eventFallbacks
+
+    def matches(self, columns: list[str]) -> bool:
+        return self.columns == columns
+
+    def applyTo(self, df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+        dfEvents = {}
+        for event, (sources, names) in self._eventColumns.items():
+            eventDF = df[sources].set_axis(names, axis=1)
+
+            for position, fallbacks in self._eventFallbacks[event]:
+                series = eventDF.iloc[:, position]
+                for fallback in fallbacks:
+                    series = series.fillna(df[fallback])
+
+                eventDF.isetitem(position, series)
+
+            dfEvents[event] = eventDF
+
+        return dfEvents
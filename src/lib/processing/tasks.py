@@ -1,16 +1,19 @@
 from pathlib import Path
 import logging
-from lib.processing.files import DataFile
+from lib.processing.files import DataFile, DataFormat
 from lib.processing.scripts import OutputScript
 import lib.downloading as dl
 from lib.crawler import Crawler
 from lib.converting import Converter
 import lib.processing.parsing as parse
+import lib.common as cmn
 from lib.secrets import Secrets
 import time
 from datetime import datetime
 from enum import Enum
 from lib.processing.mapping import Map
+from lib.progressBar import ProgressBar
+import concurrent.futures as cf
 import os
 
 class Metadata(Enum):
@@ -27,6 +30,10 @@ class Metadata(Enum):
     TASK_COMPONENTS = "task components"
     CUSTOM = ""
 
+class Executor(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
 class Task:
 
     _fileSize = "size"
@@ -34,11 +41,22 @@ class Task:
     _fileModTime = "mtime"
     _fileCTime = "ctime"
 
-    def __init__(self, workingDir: Path, foldersAsOutputs: bool = False):
+    _maxWorkers = "maxWorkers"
+    _executor = "executor"
+
+    def __init__(self, workingDir: Path, foldersAsOutputs: bool = False, maxWorkers: int = 1, executor: str = Executor.THREAD.value):
         self.workingDir = workingDir
         self.foldersAsOutputs = foldersAsOutputs
         self._subTasks: list['Task'] = []
 
+        self.maxWorkers = maxWorkers
+        if self.maxWorkers < 1:
+            raise Exception(f"Invalid `{self._maxWorkers}` value `{maxWorkers}`, must be at least 1") from AttributeError
+
+        self.executor = Executor._value2member_map_.get(executor, None)
+        if self.executor is None:
+            raise Exception(f"Unknown `{self._executor}` '{executor}', must be one of [{', '.join(Executor._value2member_map_)}]") from AttributeError
+
     def _execute(self, overwrite: bool, verbose: bool) -> tuple[bool, dict]:
         return True, {}
 
@@ -57,11 +75,18 @@ class Task:
 
         return files
 
+    def _snapshotOutputs(self) -> dict[str, dict[str, int]]:
+        return self._getWorkingDirFiles()
+
+    def _getOutputs(self, beforeFiles: dict[str, dict[str, int]]) -> list[str]:
+        # Tasks that know which files they write override this, as a shared working directory may be changed by concurrent tasks
+        return [name for name, stats in self._getWorkingDirFiles().items() if beforeFiles.get(name, {}) != stats]
+
     def run(self, overwrite: bool, verbose: bool) -> dict:
         startTime = time.perf_counter()
         startDate = datetime.now().isoformat()
 
-        beforeFiles = self._getWorkingDirFiles()
+        beforeFiles = self._snapshotOutputs()
 
         try:
             success, extraMetadata = self._execute(overwrite, verbose)
@@ -69,7 +94,7 @@ class Task:
             logging.info("Cancelling task execution early")
             return {}
         
-        outputs = [name for name, stats in self._getWorkingDirFiles().items() if beforeFiles.get(name, {}) != stats]
+        outputs = self._getOutputs(beforeFiles)
 
         duration = time.perf_counter() - startTime
         endDate = datetime.now().isoformat()
@@ -103,17 +128,23 @@ class Task:
         logging.info(f"Main task generated {len(self._subTasks)} sub-tasks, running those now...")
 
         metadata[Metadata.TASK_COMPONENTS] = []
-        for subTask in self._subTasks:
-            subTaskMetadata = subTask.run(overwrite, verbose)
+        try:
+            if self.maxWorkers > 1:
+                subTaskResults = self._runSubTasksParallel(overwrite, verbose)
+            else:
+                subTaskResults = self._runSubTasksSerial(overwrite, verbose)
 
-            if not subTaskMetadata:
-                metadata[Metadata.SUCCESS] = False
-                return metadata
+            for subTask, subTaskMetadata in zip(self._subTasks, subTaskResults):
+                if not subTaskMetadata:
+                    metadata[Metadata.SUCCESS] = False
+                    return metadata
 
-            metadata[Metadata.OUTPUTS] = metadata[Metadata.OUTPUTS] + subTaskMetadata[Metadata.OUTPUTS]
-            metadata[Metadata.SUCCESS] = metadata[Metadata.SUCCESS] & subTaskMetadata[Metadata.SUCCESS]
-            metadata[Metadata.TASK_COMPONENTS].append(subTaskMetadata)
+                metadata[Metadata.OUTPUTS] = cmn.extendUnique(metadata[Metadata.OUTPUTS], self._collectSubTaskOutputs(subTask, subTaskMetadata))
+                metadata[Metadata.SUCCESS] = metadata[Metadata.SUCCESS] & subTaskMetadata[Metadata.SUCCESS]
+                metadata[Metadata.TASK_COMPONENTS].append(subTaskMetadata)
 
+        finally:
+            self._cleanUpSubTasks()
 
         duration = time.perf_counter() - startTime
         endDate = datetime.now().isoformat()
@@ -130,13 +161,62 @@ class Task:
 
         return metadata
 
+    def _collectSubTaskOutputs(self, subTask: 'Task', subTaskMetadata: dict) -> list[str]:
+        return subTaskMetadata[Metadata.OUTPUTS]
+
+    def _cleanUpSubTasks(self) -> None:
+        # Run after sub-tasks whether or not they succeeded, so nothing they leave behind is picked up as an output later
+        return
+
+    def _runSubTasksSerial(self, overwrite: bool, verbose: bool) -> list[dict]:
+        results = []
+        for subTask in self._subTasks:
+            subTaskMetadata = subTask.run(overwrite, verbose)
+            results.append(subTaskMetadata)
+
+            if not subTaskMetadata: # Stop at first cancelled sub-task
+                break
+
+        return results
+
+    def _runSubTasksParallel(self, overwrite: bool, verbose: bool) -> list[dict]:
+        logging.info(f"Running sub-tasks with {self.maxWorkers} {self.executor.value} workers")
+
+        poolType = cf.ProcessPoolExecutor if self.executor == Executor.PROCESS else cf.ThreadPoolExecutor
+        results: list[dict] = [{} for _ in self._subTasks] # Kept in sub-task order regardless of completion order
+        progress = ProgressBar(len(self._subTasks), processName="Sub-tasks")
+
+        executor = poolType(max_workers=self.maxWorkers)
+        try:
+            futures = {executor.submit(subTask.run, overwrite, False): idx for idx, subTask in enumerate(self._subTasks)} # Silence sub-tasks to keep output readable
+            for future in cf.as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception:
+                    logging.exception(f"Sub-task #{futures[future]} raised an exception")
+
+                if verbose:
+                    progress.update()
+
+        except KeyboardInterrupt:
+            logging.info("Cancelling sub-task execution early")
+            executor.shutdown(wait=False, cancel_futures=True)
+            return [{}]
+
+        executor.shutdown()
+        return results
+
 class UrlRetrieve(Task):
 
     _url = "url"
     _name = "name"
     _auth = "auth"
+    _segments = "segments"
 
-    def __init__(self, workingDir: Path, config: dict, secretLocation: str):
+    _metaValidators = "validators"
+    _metaUnchanged = "unchanged"
+
+    def __init__(self, workingDir: Path, config: dict, secretLocation: str, previousDir: Path = None, previousMetadata: dict = {}):
         super().__init__(workingDir)
 
         self.url = config.get(self._url, None)
@@ -148,15 +228,28 @@ class UrlRetrieve(Task):
             raise Exception("No filename provided to download to") from AttributeError
 
         self.auth = config.get(self._auth, False) # True/False flag
+        self.segments = config.get(self._segments, 1)
         self.secretLocation = secretLocation
 
+        # Previous download of the same file, used to skip unchanged files
+        self.previousFile = previousDir / self.fileName if previousDir is not None else None
+        self.previousValidators = previousMetadata.get(self._metaValidators, {})
+
     def _execute(self, overwrite: bool, verbose: bool) -> tuple[bool, dict]:
         auth = None
         if self.auth:
             secrets = Secrets(self.secretLocation)
             auth = secrets.getAuth()
-    
-        return dl.download(self.url, self.workingDir / self.fileName, verbose=verbose, auth=auth), {}
+
+        previousFile = None if overwrite else self.previousFile
+        success, changed, validators = dl.conditionalDownload(self.url, self.workingDir / self.fileName, self.previousValidators, previousFile, verbose=verbose, auth=auth, segments=self.segments)
+        return success, {self._metaValidators: validators, self._metaUnchanged: not changed}
+
+    def _snapshotOutputs(self) -> dict[str, dict[str, int]]:
+        return {} # Output is known up front, avoids scanning a directory shared with other downloads
+
+    def _getOutputs(self, beforeFiles: dict[str, dict[str, int]]) -> list[str]:
+        return [self.fileName] if (self.workingDir / self.fileName).exists() else []
 
 class CrawlRetrieve(Task):
 
@@ -169,9 +262,10 @@ class CrawlRetrieve(Task):
     _properties = "properties"
     _filenameURLParts = "urlPrefix"
     _auth = "auth"
+    _segments = UrlRetrieve._segments
 
     def __init__(self, workingDir: Path, config: dict, secretLocation: str):
-        super().__init__(workingDir)
+        super().__init__(workingDir, maxWorkers=config.get(self._maxWorkers, 1), executor=config.get(self._executor, Executor.THREAD.value))
 
         self.url = config.get(self._url, None)
         self.regex = config.get(self._regex, None)
@@ -179,6 +273,7 @@ class CrawlRetrieve(Task):
         self.maxDepth = config.get(self._maxDepth, -1)
         self.filenameURLParts = config.get(self._filenameURLParts, 1)
         self.skipFolders = config.get(self._skipFolders, [])
+        self.segments = config.get(self._segments, 1)
         
         self.auth = config.get(self._auth, False) # True/False flag
         self.secretLocation = secretLocation
@@ -193,7 +288,8 @@ class CrawlRetrieve(Task):
             downloadConfig = {
                 UrlRetrieve._url: url,
                 UrlRetrieve._name: fileName,
-                UrlRetrieve._auth: self.auth
+                UrlRetrieve._auth: self.auth,
+                UrlRetrieve._segments: self.segments
             }
 
             self._subTasks.append(UrlRetrieve(self.workingDir, downloadConfig, self.secretLocation))
@@ -209,8 +305,15 @@ class ScriptRunner(Task):
     _args = "args"
     _kwargs = "kwargs"
 
+    _fanOutPrefix = ".fanOut"
+    _defaultParallelWorkers = 2 # Per input parsers can be memory heavy, so more workers must be requested explicitly
+
     def __init__(self, workingDir: Path, config: dict, dirLookup: dict[str, Path], downloaded: list[list[DataFile]], processed: list[list[DataFile]], _parseConfig: bool = True):
-        super().__init__(workingDir)
+        parallel = config.get(self._parallel, False)
+        maxWorkers = config.get(self._maxWorkers, min(self._defaultParallelWorkers, os.cpu_count() or 1) if parallel else 1)
+        executor = config.get(self._executor, Executor.PROCESS.value if parallel else Executor.THREAD.value) # Processes by default to avoid the GIL on cpu bound parsers
+
+        super().__init__(workingDir, maxWorkers=maxWorkers, executor=executor)
 
         modulePath = config.get(self._modulePath, "")
         if not modulePath:
@@ -227,7 +330,7 @@ class ScriptRunner(Task):
 
         self.args = config.get(self._args, [])
         self.kwargs = config.get(self._kwargs, {})
-        self.parallel = config.get(self._parallel, False)
+        self.parallel = parallel
 
         self._dirLookup = dirLookup
         self._downloaded = downloaded
@@ -239,19 +342,43 @@ class ScriptRunner(Task):
             success, _ = script.run(verbose, self.args, self.kwargs)
             return success, {}
 
-        for input in self.inputs:
+        # Fan out to one sub-task per input, each writing to its own folder so outputs can be attributed to their input
+        for idx, input in enumerate(self.inputs):
             scriptConfig = {
                 ScriptRunner._modulePath: self.modulePath,
                 ScriptRunner._functionName: self.functionName,
-                ScriptRunner._inputs: self.inputs,
+                ScriptRunner._inputs: [input],
                 ScriptRunner._args: self.args,
-                ScriptRunner._kwargs: self._kwargs
+                ScriptRunner._kwargs: self.kwargs
             }
 
-            self._subTasks.append(ScriptRunner(self.workingDir, scriptConfig, self._dirLookup, self._downloaded, self._processed, False))
+            subDir = self.workingDir / f"{self._fanOutPrefix}_{idx}"
+            subDir.mkdir(exist_ok=True)
+            self._subTasks.append(ScriptRunner(subDir, scriptConfig, self._dirLookup, [], [], False))
 
         return True, {}
 
+    def _collectSubTaskOutputs(self, subTask: Task, subTaskMetadata: dict) -> list[str]:
+        outputs = []
+        for fileName in subTaskMetadata[Metadata.OUTPUTS]:
+            outputPath = self.workingDir / fileName
+            if outputPath.exists():
+                logging.warning(f"Overwriting existing output '{fileName}' with sub-task output")
+                outputPath.unlink()
+
+            (subTask.workingDir / fileName).rename(outputPath)
+            outputs.append(fileName)
+
+        cmn.clearFolder(subTask.workingDir, True)
+        return outputs
+
+    def _cleanUpSubTasks(self) -> None:
+        for fanOutDir in self.workingDir.glob(f"{self._fanOutPrefix}_*"): # Left behind by failed or cancelled sub-tasks
+            cmn.clearFolder(fanOutDir, True)
+
+    def _getOutputs(self, beforeFiles: dict[str, dict[str, int]]) -> list[str]:
+        return [name for name in super()._getOutputs(beforeFiles) if not name.startswith(self._fanOutPrefix)]
+
 class Conversion(Task):
 
     _datasetID = "datasetID"
@@ -261,6 +388,9 @@ class Conversion(Task):
     _entityEvent = "entityEvent"
     _entityColumn = "entityColumn"
     _chunkSize = "chunkSize"
+    _properties = "properties"
+    _mappedColumnsOnly = "mappedColumnsOnly"
+    _outputFormat = "outputFormat"
 
     _localMapName = "map.json"
 
@@ -281,10 +411,18 @@ class Conversion(Task):
             raise Exception(f"No `input` specified") from AttributeError
         
         self.input = parse.parseInput(self.input, downloaded, processed)[0] # Singular input
+        self.input.updateProperties(config.get(self._properties, {}))
 
         self.entityEvent = config.get(self._entityEvent, "collection")
         self.entityColumn = config.get(self._entityColumn, "scientific_name")
         self.chunkSize = config.get(self._chunkSize, 1024)
+        self.mappedColumnsOnly = config.get(self._mappedColumnsOnly, False) # Skip reading columns that would only be output as unmapped
+        self.workers = config.get(self._maxWorkers, 1) # Worker processes used for mapping chunks
+
+        outputFormat = config.get(self._outputFormat, "csv")
+        self.outputFormat = DataFormat._value2member_map_.get(f".{outputFormat}", None)
+        if self.outputFormat not in (DataFormat.CSV, DataFormat.PARQUET):
+            raise Exception(f"Invalid `{self._outputFormat}` value `{outputFormat}`, must be one of: csv, parquet") from AttributeError
 
         self.unmappedPrefix = unmappedPrefix
         self.fileName = f"{name}_{dataDate}"
@@ -307,5 +445,5 @@ class Conversion(Task):
             logging.info(f"Using local map file {localMapFile}")
             map = Map.fromFile(localMapFile, self.unmappedPrefix)
 
-        converter = Converter(self.input, self.workingDir / self.fileName)
-        return converter.convert(map, self.chunkSize, self.datasetID, self.entityEvent, self.entityColumn, verbose)
+        converter = Converter(self.input, self.workingDir / self.fileName, self.outputFormat)
+        return converter.convert(map, self.chunkSize, self.datasetID, self.entityEvent, self.entityColumn, verbose, self.mappedColumnsOnly, self.workers)
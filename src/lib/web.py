@@ -0,0 +1,233 @@
+import asyncio
+import time
+import random
+import hashlib
+import json
+import os
+import logging
+import threading
+import requests
+from pathlib import Path
+from typing import Callable
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from lib.metadataStore import MetadataStore, getStore
+
+class TokenBucket:
+    # Shared between coroutines to hold requests to an average rate, allowing bursts of up to `capacity`
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock: # Waiters are served in order so no request is starved
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+
+            self._tokens -= 1
+
+class Throttle:
+    # Spaces out requests made from any thread by at least `delay` seconds
+    def __init__(self, delay: float):
+        self.delay = delay
+
+        self._nextStart = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._nextStart)
+            self._nextStart = start + self.delay
+
+        if start > now:
+            time.sleep(start - now)
+
+def backoffDelay(attempt: int, baseDelay: float = 0.5, maxDelay: float = 30) -> float:
+    # Full jitter so retries from concurrent requests don't arrive together
+    return random.uniform(0, min(maxDelay, baseDelay * 2 ** attempt))
+
+def retryAfter(response: requests.Response, default: float) -> float:
+    value = response.headers.get("Retry-After", "")
+    return float(value) if value.replace(".", "", 1).isdigit() else default
+
+def pooledSession(poolSize: int, headers: dict = {}, session: requests.Session = None) -> requests.Session:
+    # Connections are kept alive and reused by all threads sharing the session
+    if session is None:
+        session = requests.Session()
+
+    session.headers.update(headers)
+
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class ResponseCache:
+    # Bodies are stored in files named by the hash of their request, indexed in the metadata store for expiry and eviction
+
+    _resyncSaves = 1000 # Saves between recounting the cache size, picks up responses saved by other processes
+
+    def __init__(self, store: MetadataStore, cacheDir: Path, maxSize: int):
+        self.store = store
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+
+        self._evictLock = threading.Lock()
+        self._totalSize: int | None = None
+        self._savesSinceSync = 0
+
+    def requestKey(self, request: requests.PreparedRequest, varyHeaders: list[str]) -> str | None:
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+
+        if not isinstance(body, bytes): # Streamed bodies can't be hashed without consuming them
+            return None
+
+        varied = {header.lower(): request.headers.get(header, "") for header in varyHeaders}
+        identity = json.dumps([request.method, request.url, varied]).encode()
+        return hashlib.sha256(identity + b"\0" + body).hexdigest()
+
+    def _bodyPath(self, key: str) -> Path:
+        return self.cacheDir / key[:2] / key
+
+    def load(self, key: str, ttl: float, request: requests.PreparedRequest) -> requests.Response | None:
+        rows = self.store.query("SELECT created, response FROM http_cache WHERE key = ?", (key,))
+        if not rows or time.time() - rows[0][0] > ttl:
+            return None
+
+        bodyPath = self._bodyPath(key)
+        if not bodyPath.exists():
+            return None
+
+        self.store.execute("UPDATE http_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        metadata = json.loads(rows[0][1])
+
+        response = requests.Response()
+        response.status_code = metadata["status"]
+        response.reason = metadata["reason"]
+        response.url = metadata["url"]
+        response.encoding = metadata["encoding"]
+        response.headers = CaseInsensitiveDict(metadata["headers"])
+        response._content = bodyPath.read_bytes()
+        response._content_consumed = True
+        response.request = request
+        response.fromCache = True
+        return response
+
+    def save(self, key: str, source: str, response: requests.Response) -> None:
+        body = response.content
+        bodyPath = self._bodyPath(key)
+        bodyPath.parent.mkdir(parents=True, exist_ok=True)
+
+        tempPath = bodyPath.parent / f".{key}.{threading.get_ident()}.tmp"
+        tempPath.write_bytes(body)
+        os.replace(tempPath, bodyPath) # Atomic so concurrent writers of the same key never leave a partial body
+
+        metadata = {"status": response.status_code, "reason": response.reason, "url": response.url, "encoding": response.encoding, "headers": dict(response.headers)}
+        now = time.time()
+        replaced = self.store.query("SELECT size FROM http_cache WHERE key = ?", (key,))
+        self.store.execute("INSERT OR REPLACE INTO http_cache (key, source, created, accessed, size, response) VALUES (?, ?, ?, ?, ?, ?)", (key, source, now, now, len(body), json.dumps(metadata)))
+
+        with self._evictLock: # Running total avoids summing the whole table on every save
+            self._savesSinceSync += 1
+            if self._totalSize is None or self._savesSinceSync >= self._resyncSaves:
+                self._syncSize()
+            else:
+                self._totalSize += len(body) - (replaced[0][0] if replaced else 0)
+
+            if self._totalSize > self.maxSize:
+                self._evict()
+
+    def _syncSize(self) -> None:
+        self._totalSize = self.store.query("SELECT COALESCE(SUM(size), 0) FROM http_cache")[0][0]
+        self._savesSinceSync = 0
+
+    def _evict(self) -> None:
+        # Least recently used responses are removed until the cache fits its size limit, called while holding the evict lock
+        self._syncSize()
+        totalSize = self._totalSize
+        if totalSize <= self.maxSize:
+            return
+
+        removed = []
+        for key, size in self.store.query("SELECT key, size FROM http_cache ORDER BY accessed"):
+            if totalSize <= self.maxSize:
+                break
+
+            self._bodyPath(key).unlink(missing_ok=True)
+            removed.append((key,))
+            totalSize -= size
+
+        self.store.executeMany("DELETE FROM http_cache WHERE key = ?", removed)
+        self._totalSize = totalSize
+        logging.debug(f"Evicted {len(removed)} cached responses")
+
+    def clear(self, source: str) -> None:
+        keys = self.store.query("SELECT key FROM http_cache WHERE source = ?", (source,))
+        for key, in keys:
+            self._bodyPath(key).unlink(missing_ok=True)
+
+        self.store.execute("DELETE FROM http_cache WHERE source = ?", (source,))
+        with self._evictLock:
+            self._totalSize = None
+
+class CachedSession(requests.Session):
+    def __init__(self, cache: ResponseCache, source: str, ttl: float, methods: list[str], varyHeaders: list[str], throttle: Throttle = None, cacheFilter: Callable[[requests.Response], bool] = None):
+        super().__init__()
+        self.cache = cache
+        self.source = source
+        self.ttl = ttl
+        self.methods = [method.upper() for method in methods]
+        self.varyHeaders = varyHeaders
+        self.throttle = throttle
+        self.cacheFilter = cacheFilter
+
+    def _send(self, request: requests.PreparedRequest, **kwargs: dict) -> requests.Response:
+        if self.throttle is not None: # Only requests reaching the network are delayed
+            self.throttle.wait()
+
+        return super().send(request, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs: dict) -> requests.Response:
+        if self.ttl <= 0 or request.method not in self.methods or kwargs.get("stream", False):
+            return self._send(request, **kwargs)
+
+        key = self.cache.requestKey(request, self.varyHeaders)
+        if key is None:
+            return self._send(request, **kwargs)
+
+        response = self.cache.load(key, self.ttl, request)
+        if response is not None:
+            return response
+
+        response = self._send(request, **kwargs)
+        if response.ok and (self.cacheFilter is None or self.cacheFilter(response)): # Errors are always retried on the next run
+            self.cache.save(key, self.source, response)
+
+        return response
+
+_caches: dict[Path, ResponseCache] = {}
+
+def getSession(source: str, ttl: float = 86400, poolSize: int = 10, headers: dict = {}, methods: list[str] = ["GET", "HEAD"], varyHeaders: list[str] = ["Accept", "Content-Type", "Range"], maxCacheSize: int = 2 * 1024**3, politenessDelay: float = 0, cacheFilter: Callable[[requests.Response], bool] = None) -> CachedSession:
+    # Sessions for each source share one on disk cache, responses are reused for `ttl` seconds
+    # Successful responses are only cached when `cacheFilter` accepts them, for sources reporting errors in the body
+    store = getStore()
+    cacheDir = store.path.parent / "httpCache"
+    if cacheDir not in _caches:
+        _caches[cacheDir] = ResponseCache(store, cacheDir, maxCacheSize)
+
+    session = CachedSession(_caches[cacheDir], source, ttl, methods, varyHeaders, Throttle(politenessDelay) if politenessDelay > 0 else None, cacheFilter)
+    return pooledSession(poolSize, headers, session)
@@ -1,9 +1,17 @@
 from xml.etree import cElementTree as ET
+from lxml import etree
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Iterator
+from enum import Enum
 import concurrent.futures as cf
-from lib.bigFiles import RecordWriter
+from lib.bigFiles import DFWriter, RecordWriter
 import pandas as pd
+import mmap
+import logging
+
+class XMLEngine(Enum):
+    ELEMENTTREE = "etree"
+    LXML        = "lxml"
 
 class ElementContainer:
     def __init__(self, element: ET.Element, parent: 'ElementContainer' = None):
@@ -73,13 +81,195 @@ def xmlGenerator(inputPath: Path) -> Generator[ElementContainer, None, None]:
             element.clear()
             root.clear()
 
-def basicXMLProcessor(inputPath: Path, outputPath: Path, entriesPerSection: int = 0) -> None:
-    iterator = xmlGenerator(inputPath)
-    writer = RecordWriter(outputPath, entriesPerSection)
+def _cleanText(text: str) -> str:
+    if not isinstance(text, str):
+        return text
+    
+    return text.translate(text.maketrans("\t\n\r", "   ")).strip()
+
+def getRecordTag(inputPath: Path) -> str:
+    # Records are the children of the root element, named after the first child
+    for idx, (_, element) in enumerate(etree.iterparse(str(inputPath), events=("start",), huge_tree=True)):
+        if idx == 1:
+            return element.tag
+        
+    return ""
+
+def _subPath(element: etree._Element, record: etree._Element) -> str:
+    tags = []
+    while element is not None and element is not record:
+        tags.append(element.tag)
+        element = element.getparent()
+
+    return "/".join(reversed(tags))
+
+def flattenRecord(record: etree._Element, include: list[str] = [], exclude: list[str] = []) -> dict[str, any]:
+    # Iterative pre-order walk giving the same keys as flattenElement, later duplicate paths overwrite earlier ones
+    flattened = {}
+    stack = [(record, _cleanText(record.tag), "")]
+
+    while stack:
+        element, prefix, subPath = stack.pop()
+        
+        if subPath and any(subPath == path or subPath.startswith(f"{path}/") for path in exclude):
+            continue
+
+        included = not include or not subPath or any(subPath == path or subPath.startswith(f"{path}/") for path in include)
+        if included:
+            flattened[prefix] = _cleanText(element.text)
+            for attrName, attrValue in element.attrib.items():
+                flattened[f"{prefix}_{attrName}"] = attrValue
+
+        elif not any(path.startswith(f"{subPath}/") for path in include): # Not an ancestor of an included path
+            continue
+
+        for child in reversed(element):
+            childPath = f"{subPath}/{child.tag}" if subPath else child.tag
+            stack.append((child, f"{prefix}_{_cleanText(child.tag)}", childPath))
+
+    return flattened
+
+def lxmlGenerator(inputPath: 'Path | _RangeReader', recordTag: str = "", include: list[str] = [], exclude: list[str] = []) -> Iterator[dict[str, any]]:
+    if not recordTag:
+        recordTag = getRecordTag(inputPath)
+
+    # Excluded subtrees are cleared as soon as they finish parsing so they never build up within a record
+    excludedTags = list({path.rsplit("/", 1)[-1] for path in exclude})
+    source = str(inputPath) if isinstance(inputPath, Path) else inputPath
+    context = etree.iterparse(source, events=("end",), tag=[recordTag] + excludedTags, huge_tree=True, remove_comments=True, remove_pis=True)
+
+    for _, element in context:
+        parent = element.getparent()
+        isRecord = element.tag == recordTag and parent is not None and parent.getparent() is None
+
+        if not isRecord:
+            record = element
+            while record is not None and record.getparent() is not None and record.getparent().getparent() is not None:
+                record = record.getparent()
+
+            if record is not None and _subPath(element, record) in exclude:
+                element.clear()
+
+            continue
+
+        yield flattenRecord(element, include, exclude)
+
+        element.clear()
+        while element.getprevious() is not None: # Drop references to previous records held by the root
+            del parent[0]
+
+class _RangeReader:
+    # File-like view of a byte range wrapped in a synthetic root element, so a slice of records parses as a document
+
+    def __init__(self, inputPath: Path, start: int, end: int, rootTag: bytes = b"root"):
+        self._fp = open(inputPath, "rb")
+        self._fp.seek(start)
+        self._remaining = end - start
+
+        self._prefix = b"<" + rootTag + b">"
+        self._suffix = b"</" + rootTag + b">"
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            data, self._prefix = self._prefix, b""
+            return data
+        
+        if self._remaining > 0:
+            data = self._fp.read(self._remaining if size < 0 else min(size, self._remaining))
+            self._remaining = self._remaining - len(data) if data else 0
+            return data
+        
+        data, self._suffix = self._suffix, b""
+        return data
+    
+    def close(self) -> None:
+        self._fp.close()
+
+def _findOpenTag(data: mmap.mmap, openTag: bytes, start: int, end: int) -> int:
+    while True:
+        offset = data.find(openTag, start, end)
+        if offset < 0:
+            return -1
+        
+        nextChar = data[offset + len(openTag):offset + len(openTag) + 1]
+        if nextChar in (b" ", b">", b"/", b"\n", b"\r", b"\t"): # Avoid matching longer tags sharing the same prefix
+            return offset
+        
+        start = offset + 1
+
+def splitRecordRanges(inputPath: Path, recordTag: str, parts: int) -> list[tuple[int, int]]:
+    # Assumes records don't nest an element with their own tag, so every open tag found is a record boundary
+    openTag = f"<{recordTag}".encode()
+
+    with open(inputPath, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = data.rfind(b"</") # Closing tag of the root element
+        first = _findOpenTag(data, openTag, 0, end)
+        if first < 0:
+            return []
+        
+        boundaries = [first]
+        for part in range(1, parts):
+            offset = _findOpenTag(data, openTag, first + ((end - first) * part // parts), end)
+            if offset < 0:
+                break
+
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+
+    return list(zip(boundaries, boundaries[1:] + [end]))
+
+def _processRange(inputPath: Path, start: int, end: int, recordTag: str, outputPath: Path, entriesPerSection: int, subDirName: str, schema: dict[str, str], include: list[str], exclude: list[str]) -> int:
+    writer = RecordWriter(outputPath, entriesPerSection, subDirName=subDirName, schema=schema)
+    completed = writer.writtenRecordCount()
+
+    reader = _RangeReader(inputPath, start, end)
+    try:
+        for idx, record in enumerate(lxmlGenerator(reader, recordTag, include, exclude)):
+            if idx >= completed: # Records in already written chunks are skipped when resuming
+                writer.write(record)
+    finally:
+        reader.close()
+
+    writer.flush()
+    return writer.writtenFileCount()
+
+def parallelXMLProcessor(inputPath: Path, outputPath: Path, entriesPerSection: int, workers: int, schema: dict[str, str] = {}, include: list[str] = [], exclude: list[str] = [], subDirName: str = "bigFileWriter") -> None:
+    recordTag = getRecordTag(inputPath)
+    ranges = splitRecordRanges(inputPath, recordTag, workers)
+    logging.info(f"Split '{recordTag}' records into {len(ranges)} ranges")
+
+    # Each range writes its own chunks, named by range count so a different split never resumes from mismatched parts
+    partDirs = [f"{subDirName}/part_{idx}_of_{len(ranges)}" for idx in range(len(ranges))]
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_processRange, inputPath, start, end, recordTag, outputPath, entriesPerSection, partDir, schema, include, exclude) for (start, end), partDir in zip(ranges, partDirs)]
+        for future in cf.as_completed(futures):
+            future.result()
+
+    writer = DFWriter(outputPath, subDirName=subDirName, loadOnInit=False, schema=schema)
+    for partDir in partDirs:
+        writer.addWriter(RecordWriter(outputPath, entriesPerSection, subDirName=partDir, schema=schema))
+
+    writer.combine(removeParts=True)
+
+def basicXMLProcessor(inputPath: Path, outputPath: Path, entriesPerSection: int = 0, schema: dict[str, str] = {}, engine: XMLEngine = XMLEngine.ELEMENTTREE, include: list[str] = [], exclude: list[str] = [], workers: int = 1) -> None:
+    # The lxml engine flattens records differently, so it must be chosen explicitly by sources that have been checked with it
+    if workers > 1 and engine == XMLEngine.LXML:
+        parallelXMLProcessor(inputPath, outputPath, entriesPerSection, workers, schema, include, exclude)
+        return
+
+    if workers > 1:
+        logging.warning(f"Parallel processing requires the `{XMLEngine.LXML.value}` engine, processing with a single worker")
+
+    if engine == XMLEngine.LXML:
+        iterator = lxmlGenerator(inputPath, include=include, exclude=exclude)
+    else:
+        iterator = (flattenElement(element) for element in xmlGenerator(inputPath))
+
+    writer = RecordWriter(outputPath, entriesPerSection, schema=schema)
 
-    for idx, element in enumerate(iterator, start=1):
+    for idx, record in enumerate(iterator, start=1):
         print(f"At record: {idx}", end="\r")
-        writer.write(flattenElement(element))
+        writer.write(record)
         
     print()
     writer.combine(removeParts=True)
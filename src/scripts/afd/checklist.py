@@ -1,13 +1,17 @@
 import requests
 import json
+import lib.web as web
 from pathlib import Path
 import pandas as pd
 from io import BytesIO
 from lib.bigFiles import DFWriter
-from bs4 import BeautifulSoup
 from lib.progressBar import ProgressBar
-import re
 import traceback
+import concurrent.futures as cf
+from collections import deque
+from itertools import islice
+from scripts.afd.taxonParser import parseContent
+from lib.htmlParsing import SoupBackend
 from lib.processing.scripts import importableScript
 from lib.processing.files import DataFile
 
@@ -189,9 +193,40 @@ def addParents(outputDir: Path, inputFile: DataFile) -> None:
     df.to_csv(outputDir / "cleanedWithParents.csv", index=False)
 
 @importableScript()
-def enrich(outputDir: Path, inputFile: DataFile) -> None:
+def enrich(outputDir: Path, inputFile: DataFile, cacheTTL: float = 7 * 86400, maxInFlight: int = 8, politenessDelay: float = 0.1, parseWorkers: int = 4, soupBackend: str = SoupBackend.BUILTIN.value) -> None:
     df = inputFile.read(dtype=object)
-    session = requests.Session()
+    backend = SoupBackend(soupBackend) # Parity of other backends should be checked with tools/htmlBenchmark.py on saved pages first
+    session = web.getSession("afd", cacheTTL, poolSize=maxInFlight, politenessDelay=politenessDelay)
+
+    def fetchTaxon(taxonID: str) -> str:
+        response = session.get(f"https://biodiversity.org.au/afd/taxa/{taxonID}/complete")
+        if not response.ok: # Written taxa are never revisited, so failed pages must stop the run
+            raise Exception(f"Failed to retrieve taxon {taxonID}, received status code {response.status_code}")
+
+        return response.text
+
+    def enrichTaxon(fetchPool: cf.ThreadPoolExecutor, parsePool: cf.ProcessPoolExecutor, taxonID: str, rank: str) -> cf.Future:
+        # Parsing is submitted as each page arrives, leaving fetch threads free for the next request
+        parsed = cf.Future()
+
+        def setResult(future: cf.Future) -> None:
+            if parsed.cancelled():
+                return
+
+            if future.exception() is not None:
+                parsed.set_exception(future.exception())
+            else:
+                parsed.set_result(future.result())
+
+        def submitParse(fetched: cf.Future) -> None:
+            try:
+                parsePool.submit(parseContent, fetched.result(), taxonID, rank, backend).add_done_callback(setResult)
+            except BaseException as e:
+                if not parsed.cancelled():
+                    parsed.set_exception(e)
+
+        fetchPool.submit(fetchTaxon, taxonID).add_done_callback(submitParse)
+        return parsed
 
     for rank in ("Species", "Genus"):
         subDF = df[df["taxon_rank"] == rank]
@@ -200,96 +235,39 @@ def enrich(outputDir: Path, inputFile: DataFile) -> None:
         if not enrichmentPath.exists():
             writer = DFWriter(enrichmentPath)
             uniqueSeries = subDF["taxon_id"].unique()[writer.writtenFileCount():] # Do not repeat already completed chunks
-            
+
             bar = ProgressBar(len(uniqueSeries), f"{rank} Progress")
-            for taxonID in uniqueSeries:
-                bar.update()
+            taxa = iter(uniqueSeries)
+            pending: deque[tuple[str, cf.Future]] = deque()
 
-                response = session.get(f"https://biodiversity.org.au/afd/taxa/{taxonID}/complete")
+            # Taxa are fetched and parsed concurrently but written in order, so written file count stays valid for resuming
+            with cf.ThreadPoolExecutor(max_workers=maxInFlight) as fetchPool, cf.ProcessPoolExecutor(max_workers=parseWorkers) as parsePool:
                 try:
-                    records = _parseContent(response.text, taxonID, rank.lower())
-                except:
-                    print(taxonID)
-                    print(traceback.format_exc())
-                    return
-                
-                writer.write(pd.DataFrame.from_records(records), taxonID)
-
-            writer.combine()
+                    while True:
+                        for taxonID in islice(taxa, maxInFlight * 2 - len(pending)):
+                            pending.append((taxonID, enrichTaxon(fetchPool, parsePool, taxonID, rank.lower())))
 
-        enrichmentDF = pd.read_csv(enrichmentPath, dtype=object)
-        df = df.merge(enrichmentDF, "left", left_on=["taxon_id", "canonical_name"], right_on=["taxon_id", rank.lower()])
+                        if not pending:
+                            break
 
-    df.to_csv(outputDir / "enrichedAFD.csv", index=False)
+                        taxonID, future = pending.popleft()
+                        try:
+                            records = future.result()
+                        except:
+                            print(taxonID)
+                            print(traceback.format_exc())
+                            return
 
-def _parseContent(content: str, taxonID: str, rank: str) -> list[dict]:
-    soup = BeautifulSoup(content, "html.parser")
-
-    distribution = soup.find("div", {"id": "afdDistribution"})
-    distributionData = {}
-    if distribution is not None:
-        for heading in distribution.find_all("h4"):
-            key = heading.text.lower().replace(" ", "_")
-
-            if key in ("australian_region", "afrotropical_region"):
-                regionData = {}
-                countries = heading.find_next("ul")
-                if countries is None:
-                    continue
-                
-                for countryDotPoints in countries.findChildren("li"):
-                    countryName = countryDotPoints.find_next("strong").text
-                    stateData = {}
-
-                    stateDotPoints = countryDotPoints.findChild("ul")
-                    if stateDotPoints is not None:
-                        for item in stateDotPoints.find_all("li"):
-                            itemData = item.text.replace("\n", " ").split(":")
-                            if len(itemData) == 1:
-                                stateData[itemData[0].strip()] = ""
-                            else:
-                                itemKey, itemValue = itemData
-                                stateData[itemKey.strip()] = ", ".join(i.strip() for i in itemValue.split(","))
-
-                    regionData[countryName] = stateData
-
-                distributionData[key] = regionData
+                        writer.write(pd.DataFrame.from_records(records), taxonID)
+                        bar.update()
 
-            else:
-                value = heading.find_next("p")
-                if value is None:
-                    continue
-
-                text = value.text.replace("\t", " ").replace("\n", " ").strip()
-                text = re.sub(" +", " ", text)
-                distributionData[key] = text
-
-    descriptors = soup.find("div", {"id": "afdEcologicalDescriptors"})
-    descriptorList = []
-    if descriptors is not None:
-        for desc in descriptors.find_all("p"):
-            text = desc.text.replace("\t", " ").strip()
-            if text:
-                descriptorList.append(text)
-    descriptorData = {"descriptors": "|".join(descriptorList)}
-
-    records = []
-    synonyms = soup.find("div", {"id": "afdSynonyms"})
-    if synonyms is None:
-        return [{"taxon_id": taxonID} | distributionData | descriptorData]
-
-    for synonmn in synonyms.find_all("li"):
-        synonymTitle = synonmn.find_next("div")
-        synonymData = synonymTitle.find_next("div")
-
-        if synonymData.parent != synonymTitle.parent: # No type data if next div is at a lower level
-            continue
+                finally:
+                    for _, future in pending:
+                        future.cancel()
 
-        data = {}
-        for typeData in synonymData.find_all("div"):
-            data[typeData.find("h5").text.lower().replace(" ", "_")[:-1]] = synonymData.find("span").text
+            writer.combine()
 
-        record = {"taxon_id": taxonID, rank: synonymTitle.find("strong").text} | data
-        records.append(record | distributionData | descriptorData)
+        enrichmentDF = pd.read_csv(enrichmentPath, dtype=object)
+        df = df.merge(enrichmentDF, "left", left_on=["taxon_id", "canonical_name"], right_on=["taxon_id", rank.lower()])
 
-    return records
+    df.to_csv(outputDir / "enrichedAFD.csv", index=False)
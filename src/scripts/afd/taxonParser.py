@@ -0,0 +1,75 @@
+import lib.htmlParsing as htmlParsing
+from lib.htmlParsing import SoupBackend
+import re
+
+def parseContent(content: str, taxonID: str, rank: str, backend: SoupBackend = SoupBackend.BUILTIN) -> list[dict]:
+    soup = htmlParsing.getSoup(content, backend)
+
+    distribution = soup.find("div", {"id": "afdDistribution"})
+    distributionData = {}
+    if distribution is not None:
+        for heading in distribution.find_all("h4"):
+            key = heading.text.lower().replace(" ", "_")
+
+            if key in ("australian_region", "afrotropical_region"):
+                regionData = {}
+                countries = heading.find_next("ul")
+                if countries is None:
+                    continue
+                
+                for countryDotPoints in countries.findChildren("li"):
+                    countryName = countryDotPoints.find_next("strong").text
+                    stateData = {}
+
+                    stateDotPoints = countryDotPoints.findChild("ul")
+                    if stateDotPoints is not None:
+                        for item in stateDotPoints.find_all("li"):
+                            itemData = item.text.replace("\n", " ").split(":")
+                            if len(itemData) == 1:
+                                stateData[itemData[0].strip()] = ""
+                            else:
+                                itemKey, itemValue = itemData
+                                stateData[itemKey.strip()] = ", ".join(i.strip() for i in itemValue.split(","))
+
+                    regionData[countryName] = stateData
+
+                distributionData[key] = regionData
+
+            else:
+                value = heading.find_next("p")
+                if value is None:
+                    continue
+
+                text = value.text.replace("\t", " ").replace("\n", " ").strip()
+                text = re.sub(" +", " ", text)
+                distributionData[key] = text
+
+    descriptors = soup.find("div", {"id": "afdEcologicalDescriptors"})
+    descriptorList = []
+    if descriptors is not None:
+        for desc in descriptors.find_all("p"):
+            text = desc.text.replace("\t", " ").strip()
+            if text:
+                descriptorList.append(text)
+    descriptorData = {"descriptors": "|".join(descriptorList)}
+
+    records = []
+    synonyms = soup.find("div", {"id": "afdSynonyms"})
+    if synonyms is None:
+        return [{"taxon_id": taxonID} | distributionData | descriptorData]
+
+    for synonmn in synonyms.find_all("li"):
+        synonymTitle = synonmn.find_next("div")
+        synonymData = synonymTitle.find_next("div")
+
+        if synonymData.parent != synonymTitle.parent: # No type data if next div is at a lower level
+            continue
+
+        data = {}
+        for typeData in synonymData.find_all("div"):
+            data[typeData.find("h5").text.lower().replace(" ", "_")[:-1]] = synonymData.find("span").text
+
+        record = {"taxon_id": taxonID, rank: synonymTitle.find("strong").text} | data
+        records.append(record | distributionData | descriptorData)
+
+    return records
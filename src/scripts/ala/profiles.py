@@ -1,16 +1,26 @@
-import requests
 import pandas as pd
+import requests
 from pathlib import Path
 from lib.secrets import Secrets
 import lib.downloading as dl
+import lib.web as web
 from lib.progressBar import ProgressBar
 import logging
 import lib.dataframes as dff
 from lib.processing.scripts import importableScript
 
+def _isAuthorized(response: requests.Response) -> bool:
+    # Failed authorization is returned as a successful response with a message
+    try:
+        data = response.json()
+    except ValueError:
+        return True
+
+    return not (isinstance(data, dict) and "not authorized" in str(data.get("message", "")))
+
 @importableScript(inputCount=0)
-def collect(outputDir: Path, profile: str) -> None:
-    session = requests.session()
+def collect(outputDir: Path, profile: str, cacheTTL: float = 86400) -> None:
+    session = web.getSession("ala", cacheTTL, cacheFilter=_isAuthorized) # Token requests are posted so are never cached
     secrets = Secrets("ala")
 
     response = session.post(
@@ -24,10 +34,10 @@ def collect(outputDir: Path, profile: str) -> None:
 
     baseURL = "https://api.ala.org.au/profiles"
     endpoint = f"/api/opus/{profile}/profile?pageSize=1000"
-    response = requests.get(baseURL + endpoint, headers={"Authorization": f"Bearer {accessToken}"})
+    response = session.get(baseURL + endpoint, headers={"Authorization": f"Bearer {accessToken}"})
     data = response.json()
 
-    if "message" in data and "not authorized" in data["message"]:
+    if not _isAuthorized(response):
         logging.error("Failed to authorize, please make sure bearer token is valid.")
         return
     
@@ -40,7 +50,7 @@ def collect(outputDir: Path, profile: str) -> None:
     records = []
     for entry in data:
         uuid = entry["uuid"]
-        response = requests.get(baseURL + f"/api/opus/{profile}/profile/{uuid}", headers={"Authorization": f"Bearer {accessToken}"})
+        response = session.get(baseURL + f"/api/opus/{profile}/profile/{uuid}", headers={"Authorization": f"Bearer {accessToken}"})
         records.append(response.json())
         progress.update()
 
@@ -1,4 +1,5 @@
 import requests
+import lib.web as web
 from bs4 import BeautifulSoup
 import pandas as pd
 from pathlib import Path
@@ -6,11 +7,12 @@ from lib.progressBar import ProgressBar
 from lib.processing.scripts import importableScript
 
 @importableScript(inputCount=0)
-def build(outputDir: Path) -> None:
+def build(outputDir: Path, cacheTTL: float = 7 * 86400) -> None:
+    session = web.getSession("dnazoo", cacheTTL)
     retrieveURL = "https://dnazoo.s3.wasabisys.com/?delimiter=/"
     baseDLURL = "https://dnazoo.s3.wasabisys.com/"
 
-    rawHTML = requests.get(retrieveURL)
+    rawHTML = session.get(retrieveURL)
     soup = BeautifulSoup(rawHTML.text, "xml")
     allSpecies = soup.find_all("Prefix")
 
@@ -22,7 +24,7 @@ def build(outputDir: Path) -> None:
             continue
 
         dataURL = baseDLURL + species.text + "README.json"
-        rawData = requests.get(dataURL)
+        rawData = session.get(dataURL)
         if rawData.status_code != requests.codes.ok:
             continue # No JSON for this species
 
@@ -3,8 +3,9 @@ import pandas as pd
 import requests
 from pathlib import Path
 import lib.downloading as dl
+import lib.web as web
 import lib.zipping as zp
-from bs4 import BeautifulSoup
+import lib.htmlParsing as htmlParsing
 from lib.processing.scripts import importableScript
 from lib.processing.files import DataFile
 
@@ -101,14 +102,16 @@ def combine(outputDir: Path, metadataFile: DataFile, statsFile: DataFile) -> Non
     uniqueColumns = stats.columns.difference(metadata.columns)
     pd.merge(metadata, stats[uniqueColumns], how="outer", left_on="display_name", right_on="#name").to_csv(outputDir / "combined.csv", index=False)
 
-def collectVGP(outputFilePath: Path):
+def collectVGP(outputFilePath: Path, cacheTTL: float = 7 * 86400):
+    session = web.getSession("ensembl", cacheTTL)
+
     def cleanText(text: str) -> str:
         return text.strip(" \n")
     
     url = "https://projects.ensembl.org/vgp/"
 
-    pageData = requests.get(url)
-    soup = BeautifulSoup(pageData.text, "html.parser")
+    pageData = session.get(url)
+    soup = htmlParsing.getSoup(pageData.text, htmlParsing.SoupBackend.BUILTIN)
 
     table = soup.find("table")
     tableHeader = table.find("thead")
@@ -132,7 +135,7 @@ def collectVGP(outputFilePath: Path):
                     data[cleanText(link.text.lower())] = link["href"]
             elif header == "View in browser":
                 link = element.find("a")
-                data |= collectStats(link["href"])
+                data |= collectStats(link["href"], session)
             else:
                 print(f"Unknown header: {header}")
 
@@ -140,9 +143,9 @@ def collectVGP(outputFilePath: Path):
 
     pd.DataFrame.from_records(rowData).to_csv(outputFilePath, index=False)
 
-def collectStats(url: str) -> dict:
-    pageData = requests.get(url)
-    soup = BeautifulSoup(pageData.text, "html.parser")
+def collectStats(url: str, session: requests.Session = None) -> dict:
+    pageData = (session or web.getSession("ensembl")).get(url)
+    soup = htmlParsing.getSoup(pageData.text, htmlParsing.SoupBackend.BUILTIN)
 
     data = {}
     for table in soup.find_all("table"):
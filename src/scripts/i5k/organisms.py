@@ -3,12 +3,13 @@ import pandas as pd
 import concurrent.futures
 from pathlib import Path
 from bs4 import BeautifulSoup, ResultSet
+import lib.htmlParsing as htmlParsing
 from lib.processing.scripts import importableScript
 
 def _getSoup(suffix: str) -> BeautifulSoup:
     baseURL = "https://i5k.nal.usda.gov"
     response = requests.get(baseURL + suffix)
-    return BeautifulSoup(response.text, "html.parser")
+    return htmlParsing.getSoup(response.text, htmlParsing.SoupBackend.BUILTIN)
 
 def _parseAnalysisRow(tableRow: ResultSet[any]) -> dict:
     columns = tableRow.find_all("td")
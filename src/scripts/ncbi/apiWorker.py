@@ -1,18 +1,14 @@
-import sys
 import logging
+import asyncio
 import requests
-from multiprocessing import Queue
-from requests.adapters import HTTPAdapter, Retry
+import concurrent.futures as cf
+import lib.web as web
 
-def apiWorker(queue: Queue, id: int, apiKey: str, recordsPerCall: int, accessions: list[str]):
-    headers = {
-        "accept": "application/json",
-        "api-key": apiKey
-    }
+class DatasetsClient:
 
-    params = {
-        "page_size": recordsPerCall
-    }
+    _url = "https://api.ncbi.nlm.nih.gov/datasets/v2/genome/accession/{}/dataset_report"
+    _retryStatuses = (429, 500, 502, 503, 504)
+    _timeout = 60
 
     summaryFields = {
         "assembly_name": "asm_name",
@@ -29,31 +25,52 @@ def apiWorker(queue: Queue, id: int, apiKey: str, recordsPerCall: int, accession
         "non_coding_gene_count": "non_coding_gene_count"
     }
 
-    # Suppress logs about retrying urls
-    logging.getLogger("requests").setLevel(logging.CRITICAL)
-    logging.getLogger("urllib3").setLevel(logging.CRITICAL)
-
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=0.1)
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-
-    collectionAmount = (len(accessions) / recordsPerCall).__ceil__()
-    accessionStrings = []
-    for collectionNumber in range(collectionAmount):
-        accessionStrings.append("%2C".join(accessions[collectionNumber*recordsPerCall:(collectionNumber+1)*recordsPerCall]))
-
-    try:
-        for string in accessionStrings:
-            url = f"https://api.ncbi.nlm.nih.gov/datasets/v2/genome/accession/{string}/dataset_report"
-            response = session.get(url, headers=headers, params=params)
-            data = response.json()
-            records = data.get("reports", [])
-            for record in records:
-                queue.put(parseRecord(record, list(summaryFields)))
-    except KeyboardInterrupt:
-        pass
-
-    queue.put(id)
+    def __init__(self, apiKey: str, requestsPerSecond: float = 10, maxInFlight: int = 10, maxRetries: int = 5):
+        self.maxRetries = maxRetries
+
+        # Blocking requests run on a thread per in-flight request, sharing one pool of kept-alive connections
+        self._session = web.pooledSession(maxInFlight, {"accept": "application/json", "api-key": apiKey})
+        self._executor = cf.ThreadPoolExecutor(max_workers=maxInFlight)
+        self._inFlight = asyncio.Semaphore(maxInFlight)
+        self._limiter = web.TokenBucket(requestsPerSecond)
+
+        # Suppress logs about retrying urls
+        logging.getLogger("requests").setLevel(logging.CRITICAL)
+        logging.getLogger("urllib3").setLevel(logging.CRITICAL)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+    async def _get(self, url: str, params: dict) -> requests.Response:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: self._session.get(url, params=params, timeout=self._timeout))
+
+    async def getReports(self, accessions: list[str]) -> list[dict]:
+        url = self._url.format("%2C".join(accessions))
+        params = {"page_size": len(accessions)}
+
+        async with self._inFlight:
+            for attempt in range(self.maxRetries + 1):
+                await self._limiter.acquire()
+                delay = web.backoffDelay(attempt)
+
+                try:
+                    response = await self._get(url, params)
+                except requests.RequestException as e:
+                    error = str(e)
+                else:
+                    if response.status_code not in self._retryStatuses:
+                        response.raise_for_status()
+                        return [parseRecord(record, list(self.summaryFields)) for record in response.json().get("reports", [])]
+
+                    error = f"status {response.status_code}"
+                    if response.status_code == 429: # Rate limited, wait as long as requested
+                        delay = web.retryAfter(response, delay)
+
+                await asyncio.sleep(delay)
+
+        raise Exception(f"Failed to retrieve {len(accessions)} accessions after {self.maxRetries} retries, last error: {error}") from AttributeError
 
 def parseRecord(record: dict, excludeFields: list) -> dict:
     def _extractKeys(d: dict, keys: list[str], prefix: str = "", suffix: str = "") -> dict:
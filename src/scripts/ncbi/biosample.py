@@ -5,11 +5,11 @@ import lib.xml as xml
 from lib.processing.scripts import importableScript
 
 @importableScript()
-def parse(outputDir: Path, inputPath: Path):
+def parse(outputDir: Path, inputPath: Path, schema: dict[str, str] = {}, engine: str = xml.XMLEngine.ELEMENTTREE.value, workers: int = 1):
     extractedFile = zp.extract(inputPath, outputDir)
 
     xmlOutput = outputDir / "rawBiosample.csv"
-    xml.basicXMLProcessor(extractedFile, xmlOutput, 150000)
+    xml.basicXMLProcessor(extractedFile, xmlOutput, 150000, schema, engine=xml.XMLEngine(engine), workers=workers)
 
     df = pd.read_csv(xmlOutput)
     df[["decimalLatitude", "decimalLongitude"]] = df["ncbi_lat long"].str.split(" ", expand=True)
@@ -1,91 +1,176 @@
 from pathlib import Path
-import pandas as pd
 from lib.progressBar import ProgressBar
+from lib.bigFiles import RecordWriter
 import logging
 import traceback
-from typing import Generator
+import mmap
+import re
+import pyarrow as pa
+from typing import Generator, Callable
 
-def parseFlatfile(filePath: Path) -> pd.DataFrame | None:
+def parseFlatfile(filePath: Path, outputFilePath: Path, recordsPerChunk: int = 20000, schema: dict[str, str] = {}, sections: list[str] = [], features: list[str] = [], qualifiers: list[str] = []) -> int:
     logging.info(f"Parsing flat file: {filePath}")
 
-    def sectionGenerator() -> Generator[str, None, None]:
-        val = ""
-        skipping = False
-        with open(filePath) as fp:
-            for line in fp:
-                if not line[0].isspace(): # New section hit, yield previous
-                    if skipping:
-                        skipping = False
-                    else:
-                        yield val
-                        val = ""
-
-                    if line.startswith("ORIGIN"): # Start skipping next value
-                        skipping = True
-
-                if not skipping:
-                    val += line
-        
-        yield val # Yield final section after last origin
+    # Records are written out every chunk so memory stays flat regardless of file size
+    writer = RecordWriter(outputFilePath, recordsPerChunk, subDirName=f"{filePath.stem}_sections", schema=Entry.schema() | schema)
+    completed = writer.writtenRecordCount()
+    if completed:
+        logging.info(f"Already parsed {completed} records, resuming...")
+
+    recordCount = 0
+    for recordCount, record in enumerate(recordGenerator(filePath, completed, sections, features, qualifiers), start=completed+1):
+        writer.write(record)
+
+    writer.combine(removeParts=True)
+    return recordCount
+
+_recordStart = b"\nLOCUS"
+_recordEnd = b"\n//\n"
+_finalRecordEnd = b"\n//"
+_locus = b"LOCUS"
+_sequenceStart = b"\nORIGIN"
+_sectionStart = re.compile(r"\n(?=\S)") # Sections start on lines without leading whitespace
+
+def scanFlatfile(filePath: Path, skipRecords: int = 0) -> Generator[str, None, None]:
+    # Yields the file header followed by the text of each record up to its sequence
+    # Boundaries are found with byte searches so sequence data is jumped over without being decoded
+    if filePath.stat().st_size == 0:
         return
 
-    iterator = sectionGenerator()
+    with open(filePath, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = mm.find(_recordStart) + 1
+        if position <= 0: # No records in file
+            return
+
+        yield mm[:position].decode()
+
+        recordCount = 0
+        fileSize = len(mm)
+        while position < fileSize:
+            if mm[position:position + len(_locus)] != _locus: # Blank lines or footers outside of a record
+                nextStart = mm.find(_recordStart, position)
+                if nextStart < 0:
+                    if mm[position:].strip():
+                        logging.warning(f"Ignoring {fileSize - position} trailing bytes after last record of {filePath.name}")
+                    return
+
+                if mm[position:nextStart].strip():
+                    logging.warning(f"Skipping {nextStart + 1 - position} bytes between records of {filePath.name}")
+
+                position = nextStart + 1
+
+            recordEnd = mm.find(_recordEnd, position)
+            if recordEnd < 0:
+                if mm.rfind(_finalRecordEnd, position) != fileSize - len(_finalRecordEnd): # Truncated file, final record is incomplete
+                    logging.warning(f"Ignoring unterminated final record of {filePath.name}")
+                    return
+
+                recordEnd = fileSize - len(_finalRecordEnd) # Final record missing trailing newline
+
+            recordCount += 1
+            if recordCount > skipRecords:
+                sequenceStart = mm.find(_sequenceStart, position, recordEnd)
+                yield mm[position:recordEnd if sequenceStart < 0 else sequenceStart].decode()
+
+            position = recordEnd + len(_recordEnd)
+
+def recordGenerator(filePath: Path, skipRecords: int = 0, sections: list[str] = [], features: list[str] = [], qualifiers: list[str] = []) -> Generator[dict, None, None]:
+    scanner = scanFlatfile(filePath, skipRecords)
 
     # Get header data
-    _, headerData = [next(iterator) for _ in range(2)]
+    headerData = next(scanner, "")
+    if not headerData:
+        return
+
     headerData = headerData.split("\n")
     fileName = headerData[0].split(" ", 1)[0]
     date = headerData[1]
     releaseNum = headerData[3].rsplit(" ", 1)[-1]
-    loci = headerData[7].lstrip().split(" ", 1)[0]
+    loci = int(headerData[7].lstrip().split(" ", 1)[0])
     headerData = {"filename": fileName.lower(), "date": date.strip(), "release_num": releaseNum, "seq_file": f"https://ftp.ncbi.nlm.nih.gov/genbank/{fileName}.gz"}
 
     # Iterate through rest of file
-    progress = ProgressBar(int(loci))
-    records = []
-    currentEntry = Entry(headerData)
-    for sectionData in iterator:
-        if sectionData == "//\n": # End of entry
-            records.append(currentEntry)
-            progress.update(extraInfo=f"{len(records)}/{loci} loci")
-            currentEntry = Entry(headerData)
-            continue
-
-        heading, sectionData = sectionData.split(" ", 1)
-        currentEntry.addSection(heading, sectionData)
-
-    df = pd.DataFrame.from_records([entry.data for entry in records])
-    df["specimen"] = ""
-    for column in ("specimen_voucher", "isolate", "accession"):
-        if column in df.columns:
-            df["specimen"] = df["specimen"].fillna(df[column])
-
-    return df
+    progress = ProgressBar(loci)
+    progress.update(skipRecords)
+
+    sections = {section.upper() for section in sections}
+    features = set(features)
+    qualifiers = set(qualifiers)
+    parsers: dict[str, Callable | None] = {} # Parser for each heading, resolved when first seen
+
+    for recordCount, recordData in enumerate(scanner, start=skipRecords+1):
+        entry = Entry(headerData, features, qualifiers)
+        for sectionData in _sectionStart.split(recordData):
+            heading, _, sectionData = sectionData.partition(" ")
+            if heading not in parsers:
+                parsers[heading] = Entry.getParser(heading) if not sections or heading in sections else None
+
+            if parsers[heading] is not None: # Unwanted or unknown headings are never parsed
+                entry.addSection(heading, parsers[heading], sectionData)
+
+        progress.update(extraInfo=f"{recordCount}/{loci} loci")
+        yield entry.getRecord()
 
 class Entry:
 
-    __slots__ = "data"
+    __slots__ = ("data", "features", "qualifiers")
+
+    _specimenColumns = ("specimen_voucher", "isolate", "accession")
+    _referenceFields = ("bp_range", "authors", "consrtm", "title", "journal", "pubmed", "medline", "remark")
+    _excludedQualifiers = ("translation",) # Skipped unless explicitly requested
 
-    def __init__(self, headerData: dict):
+    _dblinkURLs = {
+        "BioProject": "https://www.ncbi.nlm.nih.gov/bioproject/",
+        "BioSample": "https://www.ncbi.nlm.nih.gov/biosample/",
+        "Sequence Read Archive": "https://www.ncbi.nlm.nih.gov/sra/",
+        "ProbeDB": "https://www.ncbi.nlm.nih.gov/biosample/",
+        "Assembly": "https://www.ncbi.nlm.nih.gov/assembly/",
+        "Project": "https://www.ncbi.nlm.nih.gov/bioproject/"
+    }
+
+    def __init__(self, headerData: dict, features: set[str] = set(), qualifiers: set[str] = set()):
         self.data = dict(headerData)
-        
-    def addSection(self, heading: str, data: str) -> None:
-        parser = getattr(self, f"{heading.lower()}Parser", None)
-        if parser is None:
-            return
-        
+        self.features = features
+        self.qualifiers = qualifiers
+
+    @classmethod
+    def getParser(cls, heading: str) -> Callable | None:
+        return getattr(cls, f"{heading.lower()}Parser", None)
+
+    @classmethod
+    def schema(cls) -> dict[str, pa.DataType]:
+        # Nested columns are written as arrow types rather than stringified
+        stringList = pa.list_(pa.string())
+        featureType = pa.struct([
+            ("bp_range", pa.string()),
+            ("feature", pa.string()),
+            ("qualifiers", pa.map_(pa.string(), pa.string())),
+            ("other", stringList)
+        ])
+
+        return {
+            "features_genes": pa.list_(featureType),
+            "features_other": stringList,
+            "references": pa.list_(pa.struct([(field, pa.string()) for field in cls._referenceFields]))
+        } | {dbName.lower(): stringList for dbName in cls._dblinkURLs}
+
+    def addSection(self, heading: str, parser: Callable, data: str) -> None:
         try:
-            parser(data)
+            parser(self, data)
         except:
             print(f"\nFailed to parse {heading}")
             print(traceback.format_exc())
             return
 
+    def getRecord(self) -> dict:
+        self.data["specimen"] = next((self.data[column] for column in self._specimenColumns if self.data.get(column)), "")
+        return self.data
+
     def flattenLines(self, text: str, joiner: str = " ") -> str:
         return joiner.join(line.strip() for line in text.split("\n") if line)
 
     def getSections(self, text: str, leadingWhiteSpace: int = 0, allowLeadingDigits: bool = True, flattenLines: bool = False) -> list[str]:
-        sections = []
+        sections: list[list[str]] = [] # Lines of each section, joined once all are found
         lines = text.split("\n")
         
         for line in lines:
@@ -96,17 +181,18 @@ class Entry:
                 continue
 
             if not sections:
-                sections.append(line.strip() if flattenLines else line)
+                sections.append([line.strip() if flattenLines else line])
                 continue
 
             if line[leadingWhiteSpace] != " " and all(char == " " for char in line[:leadingWhiteSpace]): # Valid section start line
                 if allowLeadingDigits or line[leadingWhiteSpace].isdigit(): # Leading character is valid for section start
-                    sections.append(line.strip() if flattenLines else line)
+                    sections.append([line.strip() if flattenLines else line])
                     continue
 
-            sections[-1] += f" {line.strip()}" if flattenLines else f"\n{line}"
+            sections[-1].append(line.strip() if flattenLines else line)
 
-        return sections
+        joiner = " " if flattenLines else "\n"
+        return [joiner.join(section) for section in sections]
     
     def locusParser(self, data: str):
         locusPropertyNames = ["locus", "base_pairs", None, "type", "shape", "seq_type", "date"] # None entry to negate "bp" text
@@ -162,22 +248,13 @@ class Entry:
             else:
                 cleanedDBs.append(db)
 
-        baseURLS = {
-            "BioProject": "https://www.ncbi.nlm.nih.gov/bioproject/",
-            "BioSample": "https://www.ncbi.nlm.nih.gov/biosample/",
-            "Sequence Read Archive": "https://www.ncbi.nlm.nih.gov/sra/",
-            "ProbeDB": "https://www.ncbi.nlm.nih.gov/biosample/",
-            "Assembly": "https://www.ncbi.nlm.nih.gov/assembly/",
-            "Project": "https://www.ncbi.nlm.nih.gov/bioproject/"
-        }
-
         for db in cleanedDBs:
             dbName, dbCodes = db.split(":")
             lowerName = dbName.lower()
 
             self.data[lowerName] = []
             for dbCode in dbCodes.split(","):
-                self.data[lowerName].append(baseURLS.get(dbName) + dbCode.strip())
+                self.data[lowerName].append(self._dblinkURLs.get(dbName) + dbCode.strip())
 
     def keywordsParser(self, data: str):
         self.data["keywords"] = "" if data.strip() == "." else self.flattenLines(data)
@@ -209,61 +286,70 @@ class Entry:
 
         self.data[references].append(referenceProperties)
 
-    def featuresParser(self, data: str):
-        extraFeatures = "other"
-
-        def linesToDict(lines: list[str]) -> dict:
-            # Clean up leading / and merge lines without leading /
-            cleanLines = []
-            for line in lines:
-                if line.startswith("/"):
-                    cleanLines.append(line[1:])
-                elif not cleanLines:
-                    cleanLines.append(line)
-                else:
-                    cleanLines[-1] += f" {line}"
-
-            # Parse cleaned lines to split key/value pairs
-            retVal = {}
-            for line in cleanLines:
-                if "=" not in line:
-                    if extraFeatures not in retVal:
-                        retVal[extraFeatures] = []
-
-                    retVal[extraFeatures].append(line)
-                    continue
+    def wantedQualifier(self, key: str) -> bool:
+        if self.qualifiers:
+            return key in self.qualifiers
+        
+        return key not in self._excludedQualifiers
+
+    def parseQualifiers(self, lines: list[str], filtered: bool) -> tuple[str, list[tuple[str, str]], list[str]]:
+        # Lines before the first qualifier continue the location, qualifiers without a value are collected separately
+        location = [lines[0].strip()]
+        qualifiers: list[tuple[str, list[str]]] = []
+        other: list[str] = []
+        current = location
+
+        for line in lines[1:]:
+            line = line.strip()
+            if not line.startswith("/"):
+                if current is not None:
+                    current.append(line)
+                continue
 
-                key, value = line.split("=", 1)
-                retVal[key] = value.strip('"')
+            key, hasValue, value = line[1:].partition("=")
+            if filtered and not self.wantedQualifier(key): # Skip lines of unwanted qualifiers without joining them
+                current = None
+                continue
+
+            if not hasValue:
+                other.append(key)
+                current = None
+                continue
 
-            return retVal
+            current = [value]
+            qualifiers.append((key, current))
 
-        data = data.split("\n", 1)[-1]
-        featureBlocks = self.getSections(data, 5)
+        return "".join(location), [(key, " ".join(value).strip('"')) for key, value in qualifiers], other
+
+    def featuresParser(self, data: str):
+        # Blocks of unwanted features are skipped without parsing their qualifiers
+        blocks: list[tuple[str, list[str]]] = []
+        skipping = False
+        for line in data.split("\n")[1:]: # First line is column headings
+            if len(line) <= 5:
+                continue
 
-        genesLabel = "features_genes"
-        self.data[genesLabel] = {}
-        for block in featureBlocks:
-            blockHeader, blockData = block.lstrip().split(" ", 1)
+            if line[5] != " " and line[:5].isspace(): # Start of feature block
+                blockHeader, _, location = line.strip().partition(" ")
+                skipping = bool(self.features) and blockHeader != "source" and blockHeader not in self.features
+                if not skipping:
+                    blocks.append((blockHeader, [location]))
+                continue
 
-            if "\n" not in blockData: # No properties after base pair range
-                bpRange = blockData.strip()
-                properties = {}
-            else: # Parse properties
-                bpRange, properties = blockData.lstrip().split("\n", 1)
-                sections = self.getSections(properties, 21, flattenLines=True)
-                properties = linesToDict(sections)
+            if not skipping and blocks:
+                blocks[-1][1].append(line)
 
+        genes = []
+        for blockHeader, lines in blocks:
             if blockHeader == "source": # Source properties get split out and put directly into data
-                properties["features_other"] = properties.pop(extraFeatures, [])
+                _, qualifiers, other = self.parseQualifiers(lines, False)
+                properties = dict(qualifiers)
+                properties["features_other"] = other
                 properties["features_organism"] = properties.pop("organism", "")
                 self.data |= properties
                 continue
 
-            if bpRange not in self.data[genesLabel]:
-                self.data[genesLabel][bpRange] = {}
-
-            properties.pop("translation", None) # Remove translation
-            self.data[genesLabel][bpRange][blockHeader] = properties
+            bpRange, qualifiers, other = self.parseQualifiers(lines, True)
+            genes.append({"bp_range": bpRange, "feature": blockHeader, "qualifiers": qualifiers, "other": other})
 
-        self.data[genesLabel] = str(self.data[genesLabel])
+        self.data["features_genes"] = genes
@@ -1,17 +1,17 @@
 import logging
 import pandas as pd
 from pathlib import Path
-from multiprocessing import Process, Queue
+import asyncio
 from lib.secrets import Secrets
 from lib.bigFiles import RecordWriter
 from lib.progressBar import ProgressBar
 from lib.processing.files import DataFile
-from scripts.ncbi.apiWorker import apiWorker
+from scripts.ncbi.apiWorker import DatasetsClient
 import numpy as np
 from lib.processing.scripts import importableScript
 
 @importableScript()
-def getStats(outputDir: Path, summaryFile: DataFile):
+def getStats(outputDir: Path, summaryFile: DataFile, requestsPerSecond: float = 10, maxInFlight: int = 10):
     secrets = Secrets("ncbi")
 
     if not secrets.key:
@@ -19,7 +19,6 @@ def getStats(outputDir: Path, summaryFile: DataFile):
         return
     
     logging.info("Found API key")
-    processes = 10
     recordsPerCall = 200
     recordsPerSubsection = 30000
     accessionCol = "#assembly_accession"
@@ -29,39 +28,36 @@ def getStats(outputDir: Path, summaryFile: DataFile):
     totalAccessions = df.size
 
     writer = RecordWriter(outputDir / summaryFile.path.name, recordsPerSubsection)
-    startingAccession = writer.writtenFileCount() * recordsPerSubsection
-    accessionsPerProcess = ((totalAccessions - startingAccession) / processes).__ceil__()
+    completed = writer.completedBatchKeys()
+    if completed:
+        logging.info(f"Already retrieved {len(completed)} accessions, resuming...")
 
-    queue = Queue()
-    processList: list[Process] = []
-    for processNumber in range(processes):
-        start = startingAccession + (processNumber * accessionsPerProcess)
-        end = start + accessionsPerProcess
-        accessions = df[accessionCol].iloc[start:end].tolist()
-        p = Process(target=apiWorker, args=(queue, processNumber, secrets.key, recordsPerCall, accessions), daemon=True)
-        p.start()
-        processList.append(p)
-    logging.info(f"Started {len(processList)} workers")
+    accessions = [accession for accession in dict.fromkeys(df[accessionCol].dropna()) if accession not in completed]
+    batches = [accessions[idx:idx+recordsPerCall] for idx in range(0, len(accessions), recordsPerCall)]
 
-    progress = ProgressBar(totalAccessions - startingAccession)
-    try:
-        while processes > 0:
-            data = queue.get()
-            if isinstance(data, int): # Termination ID
-                processList[data].join()
-                processes -= 1
-                continue
+    async def fetch(client: DatasetsClient, batch: list[str]) -> tuple[list[str], list[dict]]:
+        return batch, await client.getReports(batch)
+
+    async def collect(client: DatasetsClient) -> None:
+        progress = ProgressBar(len(accessions))
+        for task in asyncio.as_completed([fetch(client, batch) for batch in batches]):
+            batch, records = await task
+            writer.writeBatch(records, batch) # Written from the event loop so records never leave this process
+            progress.update(len(batch))
 
-            writer.write(data)
-            progress.update()
+    logging.info(f"Retrieving {len(accessions)} of {totalAccessions} accessions at up to {requestsPerSecond} requests per second")
+    client = DatasetsClient(secrets.key, requestsPerSecond, maxInFlight)
+    try:
+        asyncio.run(collect(client))
 
     except KeyboardInterrupt:
-        for process in processList:
-            process.join()
         print()
-        logging.info("Cleaned up workers")
-
+        logging.info("Stopped retrieving stats")
         return
+    
+    finally:
+        client.close()
+        writer.flush() # Pending records only hold complete batches so are kept for resuming
 
     writer.combine(removeParts=False, index=False)
 
@@ -4,13 +4,10 @@ import scripts.ncbi.flatFileParser as ffp
 from lib.processing.scripts import importableScript
 
 @importableScript()
-def parse(outputDir: Path, inputPath: Path) -> None:
+def parse(outputDir: Path, inputPath: Path, schema: dict[str, str] = {}, sections: list[str] = [], features: list[str] = [], qualifiers: list[str] = []) -> None:
     extractedFile = zp.extract(inputPath, outputDir)
     if extractedFile is None:
         return
     
-    df = ffp.parseFlatfile(extractedFile)
-    if df is not None:
-        df.to_parquet(f"{extractedFile.stem}.parquet")
-    
+    ffp.parseFlatfile(extractedFile, outputDir / f"{extractedFile.stem}.parquet", schema=schema, sections=sections, features=features, qualifiers=qualifiers)
     extractedFile.unlink()
@@ -1,7 +1,9 @@
 from pathlib import Path
 import pandas as pd
+import numpy as np
+import io
+import csv
 from enum import Enum
-from lib.progressBar import ProgressBar
 from lib.processing.scripts import importableScript
 import lib.zipping as zp
 
@@ -67,82 +69,101 @@ headings = {
     ]
 }
 
-class Node:
-    __slots__ = headings[DumpFile.NODES]
+integerColumns = {
+    "tax_id": "int64",
+    "parent_tax_id": "int64",
+    "division_id": "int64",
+    "genetic_code_id": "int64",
+    "mitochondrial_genetic_code_id": "int64",
+    "inherited_div_flag": "int8",
+    "inherited_GC_flag": "int8",
+    "inherited_MGC_flag": "int8",
+    "GenBank_hidden_flag": "int8",
+    "hidden_subtree_root_flag": "int8",
+    "old_tax_id": "int64",
+    "new_tax_id": "int64"
+}
 
-    inheritedAttrs = {
-        "inherited_div_flag": "division_id",
-        "inherited_GC_flag": "genetic_code_id",
-        "inherited_MGC_flag": "mitochondrial_genetic_code_id",
-    }
+inheritedColumns = {
+    "inherited_div_flag": "division_id",
+    "inherited_GC_flag": "genetic_code_id",
+    "inherited_MGC_flag": "mitochondrial_genetic_code_id",
+}
 
-    hiddenAttrs = [
-        "GenBank_hidden_flag",
-        "hidden_subtree_root_flag"
-    ]
+hiddenColumns = [
+    "GenBank_hidden_flag",
+    "hidden_subtree_root_flag"
+]
 
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            if k in self.hiddenAttrs or k in self.inheritedAttrs:
-                v = bool(int(v))
+def resolveInheritance(data: pd.DataFrame) -> pd.DataFrame:
+    taxIDs = data["tax_id"].astype(np.int64).to_numpy()
+    parentIDs = data["parent_tax_id"].astype(np.int64).to_numpy()
+    parents = pd.Index(taxIDs).get_indexer(parentIDs) # Row position of each parent, -1 if missing
+    rows = np.arange(len(data))
+    maxJumps = int(np.ceil(np.log2(max(len(data), 2)))) + 1 # Enough doublings to cover the deepest possible lineage
 
-            setattr(self, k, v)
+    for flagColumn, valueColumn in inheritedColumns.items():
+        inherits = data[flagColumn].astype(int).to_numpy().astype(bool) & (parents >= 0)
 
-    def resolveInherit(self, nodes: dict[int, 'Node']) -> None:
-        for flagAttr, valueAttr in self.inheritedAttrs.items():
-            if getattr(self, flagAttr):
-                parentNode = nodes[self.parent_tax_id]
-                parentNode.resolveInherit(nodes)
-                setattr(self, flagAttr, False)
-                setattr(self, valueAttr, getattr(parentNode, valueAttr))
+        # Each row points to the row it takes its value from, pointer jumping halves the remaining distance every pass
+        initialSource = np.where(inherits, parents, rows)
+        source = initialSource
+        for _ in range(maxJumps):
+            nextSource = source[source]
+            if np.array_equal(nextSource, source):
+                break
 
-    def package(self) -> dict:
-        return {attr: getattr(self, attr) for attr in self.__slots__ if attr not in self.inheritedAttrs and attr not in self.hiddenAttrs}
+            source = nextSource
 
-def resolveInheritance(data: pd.DataFrame) -> pd.DataFrame:
-    nodes: dict[str, Node] = {}
-    nodeProgress = ProgressBar(len(data), processName="Creating Nodes")
-    for _, row in data.iterrows():
-        node = Node(**row.to_dict())
-        nodes[node.tax_id] = node
-        nodeProgress.update()
+        # Resolved rows end at a row holding its own value, cycles either never settle or settle on a row that still inherits
+        if not np.array_equal(initialSource[source], source):
+            raise Exception(f"Unable to resolve '{valueColumn}', cycle found in parent nodes") from AttributeError
+
+        data[valueColumn] = data[valueColumn].to_numpy()[source]
+
+    return data.drop(list(inheritedColumns) + hiddenColumns, axis=1)
 
-    records = []
-    recordProgress = ProgressBar(len(nodes), processName="Resolving Inheritance")
-    for node in nodes.values():
-        node.resolveInherit(nodes)
-        records.append(node.package())
-        recordProgress.update()
+def loadDump(filePath: Path, dumpFile: DumpFile) -> pd.DataFrame:
+    # Rows are delimited by "\t|\t" and terminated by "\t|\n", converted to plain tabs for the C csv parser
+    with open(filePath, "rb") as fp:
+        data = fp.read().replace(b"\t|\n", b"\n").replace(b"\t|\t", b"\t")
 
-    return pd.DataFrame.from_records(records)
+    columns = headings[dumpFile]
+    dtypes = {column: integerColumns.get(column, "str") for column in columns}
+    return pd.read_csv(io.BytesIO(data), sep="\t", header=None, names=columns, dtype=dtypes, quoting=csv.QUOTE_NONE, na_filter=False, engine="c")
 
-def flattenNames(df: pd.DataFrame) -> pd.DataFrame:
-    data = {}
-    flattenProgress = ProgressBar(len(df), processName="Flattening Names")
-    for _, row in df.iterrows():
-        taxID = row["tax_id"]
-        text = row["name_txt"]
-        nameClass = row["name_class"]
+def flattenNames(df: pd.DataFrame, keep: str = "last") -> pd.DataFrame:
+    # One column per name class, where a taxon has multiple names of a class only the first or last is kept
+    df = df.drop_duplicates(["tax_id", "name_class"], keep=keep)
+    df = df.pivot(index="tax_id", columns="name_class", values="name_txt")
+    df.columns.name = None
+    return df.reset_index()
 
-        if taxID not in data:
-            data[taxID] = {"tax_id": taxID}
+def cleanAuthority(authority: pd.Series, *prefixes: pd.Series) -> pd.Series:
+    authority = authority.fillna("").astype(str).str.strip()
 
-        data[taxID][nameClass] = text
-        
-        flattenProgress.update()
+    for prefix in prefixes: # Prefixes differ per row, so rows are grouped by prefix length to slice each group at once
+        prefix = prefix.fillna("").astype(str).to_numpy()
+        lengths = pd.Series(prefix).str.len().to_numpy()
+        values = authority.to_numpy(dtype=object, copy=True)
 
-    return pd.DataFrame.from_dict(data, orient="index")
+        for length in np.unique(lengths[lengths > 0]):
+            rows = np.flatnonzero(lengths == length)
+            group = pd.Series(values[rows], dtype=object)
+            matched = (group.str[:length] == prefix[rows]).to_numpy()
+            values[rows[matched]] = group[matched].str[length:].to_numpy()
 
+        authority = pd.Series(values, index=authority.index, dtype=object).str.strip()
+
+    bracketed = authority.str.startswith("(") & authority.str.endswith(")")
+    return authority.mask(bracketed, authority.str[1:-1])
 
 @importableScript()
-def parse(outputDir: Path, inputPath: Path) -> None:
+def parse(outputDir: Path, inputPath: Path, duplicateNames: str = "last") -> None:
     extractedFolder = zp.extract(inputPath, outputDir)
 
     def loadDF(dumpFile: DumpFile) -> pd.DataFrame:
-        with open(extractedFolder / dumpFile.value) as fp:
-            records = [line.strip("\t|\n").split("\t|\t") for line in fp.readlines()]
-
-        return pd.DataFrame.from_records(records, columns=headings[dumpFile])
+        return loadDump(extractedFolder / dumpFile.value, dumpFile)
 
     df = loadDF(DumpFile.NODES)
     df = resolveInheritance(df)
@@ -150,7 +171,7 @@ def parse(outputDir: Path, inputPath: Path) -> None:
     # df = df[["tax_id", "parent_tax_id", "rank"]]
 
     names = loadDF(DumpFile.NAMES)
-    names = flattenNames(names)
+    names = flattenNames(names, duplicateNames)
 
     df = df.merge(names, "left", on="tax_id")
 
@@ -173,26 +194,8 @@ def parse(outputDir: Path, inputPath: Path) -> None:
         "ENV": "ICN",
     }
 
-    df["nomenclatural_code"] = df["division_cde"].apply(lambda x: divisionMap[x])
-
-    def cleanAuthority(authority: any, scientificName: any, synonym: any) -> str:
-        authority: str = str(authority).strip()
-
-        for item in (scientificName, synonym):
-            itemStr = str(item)
-
-            if authority.startswith(itemStr):
-                authority = authority[len(itemStr):].strip()
-
-        if not authority:
-            return authority
-        
-        if authority[0] == "(" and authority[-1] == ")":
-            authority = authority[1:-1]
-
-        return authority
-
-    df["authority"] = df.apply(lambda x: cleanAuthority(x["authority"], x["scientific name"], x["synonym"]), axis=1)
+    df["nomenclatural_code"] = df["division_cde"].map(divisionMap)
+    df["authority"] = cleanAuthority(df["authority"], df["scientific name"], df["synonym"])
 
     df["taxonomic_status"] = ""
     df["nomenclatural_act"] = "names usage"
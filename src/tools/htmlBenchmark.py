@@ -0,0 +1,52 @@
+from pathlib import Path
+import argparse
+import time
+from bs4 import BeautifulSoup
+import lib.htmlParsing as htmlParsing
+from lib.htmlParsing import SoupBackend
+from scripts.afd.taxonParser import parseContent
+
+fixturesDir = Path(__file__).parent / "fixtures" / "html"
+
+def timeCall(func: callable, repeats: int) -> tuple[float, any]:
+    # Best of repeats, so timings aren't skewed by other load on the machine
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+def compare(label: str, baseline: callable, candidate: callable, repeats: int) -> None:
+    baselineTime, baselineResult = timeCall(baseline, repeats)
+    candidateTime, candidateResult = timeCall(candidate, repeats)
+
+    match = "matching" if baselineResult == candidateResult else "DIFFERENT"
+    print(f"{label:<24} {baselineTime*1000:>9.2f}ms {candidateTime*1000:>9.2f}ms {baselineTime/candidateTime:>7.1f}x  {match}")
+
+def benchmarkLinks(content: str, repeats: int) -> None:
+    baseline = lambda: [link.get("href") for link in BeautifulSoup(content, SoupBackend.BUILTIN.value).find_all("a")]
+    candidate = lambda: htmlParsing.extractLinks(content)
+    compare("directory links", baseline, candidate, repeats)
+
+def benchmarkAFD(content: str, repeats: int) -> None:
+    baseline = lambda: parseContent(content, "benchmark", "species", SoupBackend.BUILTIN)
+    candidate = lambda: parseContent(content, "benchmark", "species", SoupBackend.LXML)
+    compare("afd taxon", baseline, candidate, repeats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare html parsing backends on saved pages")
+    parser.add_argument("repeats", type=int, help="Times to parse each page", default=20, nargs="?")
+    parser.add_argument("-i", "--index", type=Path, help="Directory index page", default=fixturesDir / "directoryIndex.html")
+    parser.add_argument("-a", "--afd", type=Path, help="Saved AFD taxon page, the bundled fixture is hand-made so real pages should be checked before changing backends", default=fixturesDir / "afdTaxon.html")
+
+    args = parser.parse_args()
+    if args.repeats < 1:
+        print("Repeats must be a positive number")
+        exit()
+
+    print(f"{'Page':<24} {'html.parser':>11} {'fast':>11} {'speedup':>8}")
+    print("-" * 64)
+    benchmarkLinks(args.index.read_text(), args.repeats)
+    benchmarkAFD(args.afd.read_text(), args.repeats)
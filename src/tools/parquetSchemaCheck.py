@@ -0,0 +1,42 @@
+from pathlib import Path
+import argparse
+import tempfile
+import pandas as pd
+import pyarrow as pa
+from lib.processing.files import DataFile
+from lib.bigFiles import combineParquetFiles
+
+# Each case is the chunks written separately, and the expected combined type of column "value"
+cases = {
+    "sparse float": ([[1.5, 2.5], [None, None]], pa.float64()),
+    "sparse int": ([[None, None], [1, 2]], pa.int64()),
+    "int and float": ([[1, 2], [0.5, None]], pa.float64()),
+    "int and string": ([[1, 2], ["a", None]], pa.string()),
+    "all empty": ([[None, None], [None, None]], pa.string())
+}
+
+def checkCase(workingDir: Path, chunks: list[list], expected: pa.DataType) -> pa.DataType:
+    chunkFiles = []
+    for idx, values in enumerate(chunks):
+        chunkFile = DataFile(workingDir / f"chunk_{idx}.parquet")
+        chunkFile.write(pd.DataFrame({"id": [f"{idx}_{pos}" for pos in range(len(values))], "value": pd.Series(values, dtype=object)}))
+        chunkFiles.append(chunkFile)
+
+    outputFile = DataFile(workingDir / "combined.parquet")
+    combineParquetFiles(outputFile, chunkFiles, ["id", "value"])
+    return outputFile.getSchema().field("value").type
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check column types of combined parquet chunks, including chunks with empty columns")
+    parser.parse_args()
+
+    failed = 0
+    for name, (chunks, expected) in cases.items():
+        with tempfile.TemporaryDirectory() as workingDir:
+            result = checkCase(Path(workingDir), chunks, expected)
+
+        matched = result == expected
+        failed += not matched
+        print(f"{name:<16} expected {str(expected):<8} got {str(result):<8} {'ok' if matched else 'FAILED'}")
+
+    exit(1 if failed else 0)
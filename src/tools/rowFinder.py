@@ -23,13 +23,8 @@ if __name__ == '__main__':
             continue
 
         foundRows = []
-        for idx, df in enumerate(stageFile.readIterator(args.chunksize, on_bad_lines="skip"), start=1):
+        for idx, df in enumerate(stageFile.readIterator(args.chunksize, filters=[(args.column, "in", args.values)], on_bad_lines="skip"), start=1):
             print(f"At chunk: {idx}", end="\r")
-
-            df = df[df[args.column].isin(args.values)]
-            if df.empty:
-                continue
-
             foundRows.append(df)
 
         if not foundRows:
@@ -7,4 +7,4 @@ if __name__ == '__main__':
     
     sources, flags, args = parser.parseArgs()
     for source in sources:
-        source.update()
+        source.update(flags)